@@ -0,0 +1,308 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_widgets
+
+headless timings of the custom_qt_widgets hot paths.
+
+Every case is timed at each of the given sizes (rows, items or widgets)
+and reports wall time (best of --repeat runs) and, from one extra run, the
+growth of the process resident memory (Qt/C++ objects included) and the
+peak of the Python heap (tracemalloc, Python objects only). Results can be
+saved as a named baseline and later runs compared against it.
+
+usage:
+    python benchmarks/bench_widgets.py
+    python benchmarks/bench_widgets.py --sizes 1000 10000 --save v1
+    python benchmarks/bench_widgets.py --compare v1
+
+Runs on the offscreen Qt platform; Qt builds without it need a virtual
+X server (xvfb-run python benchmarks/bench_widgets.py).
+
+"""
+
+import os
+import sys
+import gc
+import json
+import argparse
+import platform
+import tracemalloc
+try:
+    import resource
+except ImportError:
+    # windows
+    resource = None
+try:
+    import psutil
+except ImportError:
+    psutil = None
+from time import gmtime
+from time import strftime
+from time import perf_counter
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from PyQt4 import QtGui
+from PyQt4 import QtCore
+
+import custom_qt_widgets as cqw
+
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+DEFAULT_SIZES = (1000, 10000, 100000)
+COLUMNS = 10
+VALID_IDS = list(range(0, 100, 2))
+
+
+def make_rows(count, columns=COLUMNS):
+    # key, text columns and an int validity id in the last column
+    return [[str(r)] + ['row {} col {}'.format(r, c) for c in range(1, columns - 1)] + [r % 100]
+            for r in range(count)]
+
+
+def make_items(count):
+    return ['PN-{:07d} part {}'.format(i, i % 97) for i in range(count)]
+
+
+# cases: take the size, do the setup and return the callable to time ##########
+def table_set_table_data(size, virtual):
+    rows = make_rows(size)
+    table = cqw.DBTable(virtual=virtual)
+    return lambda: table.set_table_data({'data': rows}, mode='replace')
+
+
+def table_add_single_row(size, virtual):
+    rows = make_rows(size)
+    table = cqw.DBTable(virtual=virtual)
+
+    def run():
+        for row in rows:
+            table.add_single_row(row)
+    return run
+
+
+def filled_table(size, virtual):
+    table = cqw.DBTable(virtual=virtual)
+    table.set_table_data({'data': make_rows(size)}, mode='replace')
+    return table
+
+
+def table_check_valid_data(size, virtual):
+    table = filled_table(size, virtual)
+    return lambda: table.check_valid_data(COLUMNS - 1, VALID_IDS)
+
+
+def table_update_row_color(size, virtual):
+    table = filled_table(size, virtual)
+
+    def run():
+        for row in range(table.row_count()):
+            table.update_row_color(row, 'red')
+    return run
+
+
+def table_resize_table_view(size, virtual):
+    table = filled_table(size, virtual)
+    return table.resize_table_view
+
+
+def table_remove_rows_where(size, virtual):
+    # every tenth row, so the removal is scattered over the whole table
+    table = filled_table(size, virtual)
+    # the item model keeps the cells as text
+    return lambda: table.remove_rows_where(lambda value: int(value) % 10 == 0, COLUMNS - 1)
+
+
+def combobox_add_items(size):
+    items = make_items(size)
+    combobox = cqw.DBComboBox()
+    return lambda: combobox.add_items(items, [])
+
+
+def combobox_set_text(size):
+    items = make_items(size)
+    combobox = cqw.DBComboBox()
+    combobox.add_items(items, [])
+    needles = [items[i][3:10] for i in range(0, size, max(size // 100, 1))]
+
+    def run():
+        for txt in needles:
+            combobox.set_text(txt)
+    return run
+
+
+def icon_construction(size):
+    parent = QtGui.QWidget()
+
+    def run():
+        for i in range(size // 10):
+            cqw.DBIcon(parent, name='icon{}'.format(i))
+    return run
+
+
+def form_construction(size):
+    # a form with size // 100 fields of every kind
+    def run():
+        form = QtGui.QWidget()
+        layout = QtGui.QVBoxLayout(form)
+        for i in range(max(size // 100, 1)):
+            for cls in (cqw.DBComboBox, cqw.DBLineEdit, cqw.DBTextEdit, cqw.DBLabel, cqw.DBTable):
+                widget = cls(form, name='{}{}'.format(cls.__name__, i))
+                widget.update_title('field {}'.format(i))
+                layout.addWidget(widget)
+            layout.addWidget(cqw.DBIcon(form))
+        form.show()
+        QtGui.QApplication.processEvents()
+    return run
+
+
+CASES = [
+    ('DBTable.set_table_data', lambda size: table_set_table_data(size, False)),
+    ('DBTable.set_table_data virtual', lambda size: table_set_table_data(size, True)),
+    ('DBTable.add_single_row', lambda size: table_add_single_row(size, False)),
+    ('DBTable.add_single_row virtual', lambda size: table_add_single_row(size, True)),
+    ('DBTable.check_valid_data', lambda size: table_check_valid_data(size, False)),
+    ('DBTable.check_valid_data virtual', lambda size: table_check_valid_data(size, True)),
+    ('DBTable.update_row_color', lambda size: table_update_row_color(size, False)),
+    ('DBTable.update_row_color virtual', lambda size: table_update_row_color(size, True)),
+    ('DBTable.resize_table_view', lambda size: table_resize_table_view(size, False)),
+    ('DBTable.remove_rows_where', lambda size: table_remove_rows_where(size, False)),
+    ('DBTable.remove_rows_where virtual', lambda size: table_remove_rows_where(size, True)),
+    ('DBComboBox.add_items', combobox_add_items),
+    ('DBComboBox.set_text', combobox_set_text),
+    ('DBIcon construction', icon_construction),
+    ('form construction', form_construction),
+]
+
+
+# running #####################################################################
+def rss_kb():
+    # current resident memory of the process, None where it cannot be read
+    if psutil is not None:
+        return psutil.Process().memory_info().rss // 1024
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is not None:
+        # peak instead of current, only grows
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak // 1024 if sys.platform == 'darwin' else peak
+    return None
+
+
+def measure(case, size, repeat):
+    # best wall time of repeat runs, then one run for the memory: growth of the
+    # process rss (Qt objects included) and peak of the Python heap
+    best = None
+    for _ in range(repeat):
+        run = case(size)
+        gc.collect()
+        start = perf_counter()
+        run()
+        QtGui.QApplication.processEvents()
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    run = case(size)
+    gc.collect()
+    rss_before = rss_kb()
+    tracemalloc.start()
+    run()
+    QtGui.QApplication.processEvents()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    rss_after = rss_kb()
+
+    rss_growth = None
+    if rss_before is not None and rss_after is not None:
+        rss_growth = rss_after - rss_before
+    return {'time_s': best, 'rss_kb': rss_growth, 'py_heap_kb': peak // 1024}
+
+
+def run_cases(sizes, repeat, selected=None):
+    results = {}
+    for name, case in CASES:
+        if selected and not any(s.lower() in name.lower() for s in selected):
+            continue
+        results[name] = {}
+        for size in sizes:
+            result = measure(case, size, repeat)
+            results[name][str(size)] = result
+            print('{:<36} {:>8} {:>10.4f} s {:>10} kB rss {:>10} kB py heap'.format(
+                name, size, result['time_s'], result['rss_kb'], result['py_heap_kb']))
+            sys.stdout.flush()
+    return results
+
+
+def baseline_path(name):
+    return os.path.join(BASELINE_DIR, '{}.json'.format(name))
+
+
+def save_baseline(name, results):
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    data = {
+        'created': strftime('%Y-%m-%d %H:%M:%S', gmtime()),
+        'python': platform.python_version(),
+        'qt': QtCore.QT_VERSION_STR,
+        'results': results,
+    }
+    with open(baseline_path(name), 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    print('saved baseline {}'.format(baseline_path(name)))
+
+
+def compare_baseline(name, results, threshold):
+    # print time ratios against a saved baseline; returns the regressed cases
+    with open(baseline_path(name)) as f:
+        baseline = json.load(f)['results']
+
+    regressions = []
+    print('\ncompared with baseline {}'.format(name))
+    for case, sizes in sorted(results.items()):
+        for size, result in sorted(sizes.items(), key=lambda kv: int(kv[0])):
+            old = baseline.get(case, {}).get(size)
+            if not old or not old['time_s']:
+                continue
+            ratio = result['time_s'] / old['time_s']
+            flag = ''
+            if ratio > threshold:
+                flag = '  REGRESSION'
+                regressions.append((case, size, ratio))
+            heap_ratio = result['py_heap_kb'] / max(old['py_heap_kb'], 1)
+            if result['rss_kb'] is not None and old.get('rss_kb') is not None:
+                rss = '{:>7.2f}x rss'.format(max(result['rss_kb'], 1) / max(old['rss_kb'], 1))
+            else:
+                rss = '{:>7} rss'.format('-')
+            print('{:<36} {:>8} {:>7.2f}x time {} {:>7.2f}x py heap{}'.format(
+                case, size, ratio, rss, heap_ratio, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='benchmarks of custom_qt_widgets')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--case', nargs='+', help='only cases whose name contains one of these')
+    parser.add_argument('--save', metavar='NAME', help='save the results as baseline NAME')
+    parser.add_argument('--compare', metavar='NAME', help='compare with baseline NAME')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='time ratio reported as a regression')
+    args = parser.parse_args(argv)
+
+    app = QtGui.QApplication.instance() or QtGui.QApplication(sys.argv[:1])
+    results = run_cases(args.sizes, args.repeat, args.case)
+
+    if args.save:
+        save_baseline(args.save, results)
+    if args.compare:
+        if compare_baseline(args.compare, results, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -8,32 +8,499 @@ used as base class for configurable basic GUIs that interact with the Database.
 Author: Akshay Verma
 Date: 02-2017
 
-""""
+"""
 
 import os
 import sys
+import csv
 import json
+import mmap
+import struct
+import threading
 import logging
+import bisect
+import operator
+import functools
+import itertools
+from array import array
+from collections import OrderedDict
+from collections import deque
+from contextlib import contextmanager
 from time import gmtime
 from time import strftime
 from time import monotonic
+from time import time
+from concurrent.futures import ThreadPoolExecutor
 
 from PyQt4 import QtGui
 from PyQt4 import QtCore
 
 
+logger = logging.getLogger(__name__)
+
+
+# instrumentation #############################################################
+class DBMetrics(object):
+    """Timings of the DB widget operations, per widget name
+
+    - off by default, enable() starts recording
+    - counts, total and worst time are kept per (widget name, operation, method)
+    - operations slower than threshold_ms are logged with their row count
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.threshold_ms = 100.0
+        self._stats = {}
+
+    def enable(self, threshold_ms=None):
+        if threshold_ms is not None:
+            self.threshold_ms = threshold_ms
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        self._stats = {}
+
+    def record(self, widget_name, operation, method, elapsed_ms, rows=None):
+        key = (widget_name, operation, method)
+        stat = self._stats.get(key)
+        if stat is None:
+            stat = self._stats[key] = {'widget': widget_name, 'operation': operation, 'method': method,
+                                       'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'rows': None,
+                                       'slow': 0}
+        stat['count'] += 1
+        stat['total_ms'] += elapsed_ms
+        stat['max_ms'] = max(stat['max_ms'], elapsed_ms)
+        stat['rows'] = rows
+        if elapsed_ms >= self.threshold_ms:
+            stat['slow'] += 1
+            logger.warning('slow %s: %s.%s took %.1f ms (%s rows)',
+                           operation, widget_name, method, elapsed_ms, rows)
+
+    def stats(self, widget_name=None, operation=None):
+        # recorded operations, the most expensive first
+        stats = [dict(stat) for stat in self._stats.values()
+                 if (widget_name is None or stat['widget'] == widget_name)
+                 and (operation is None or stat['operation'] == operation)]
+        return sorted(stats, key=lambda stat: stat['total_ms'], reverse=True)
+
+    def report(self, limit=20):
+        lines = ['{:<20} {:<12} {:<22} {:>7} {:>10} {:>9} {:>8}'.format(
+            'widget', 'operation', 'method', 'count', 'total ms', 'max ms', 'rows')]
+        for stat in self.stats()[:limit]:
+            lines.append('{widget:<20} {operation:<12} {method:<22} {count:>7} {total_ms:>10.1f} '
+                         '{max_ms:>9.1f} {rows!s:>8}'.format(**stat))
+        return '\n'.join(lines)
+
+
+metrics = DBMetrics()
+
+
+def _row_count(widget):
+    # rows held by a widget, None for widgets without rows
+    for attr in ('data_model', 'item_model'):
+        model = getattr(widget, attr, None)
+        if model is not None:
+            return model.rowCount()
+    return None
+
+
+# (widget id, operation) of the instrumented calls running now
+_open_spans = set()
+
+
+def instrumented(operation):
+    # time a DB widget method in the metrics registry when it is enabled
+    # a call made inside another call of the same operation on the same widget
+    # (e.g. upsert_rows from set_table_data) is part of the outer timing only
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            span = (id(self), operation)
+            if not metrics.enabled or span in _open_spans:
+                return method(self, *args, **kwargs)
+            _open_spans.add(span)
+            start = monotonic()
+            try:
+                result = method(self, *args, **kwargs)
+            finally:
+                _open_spans.discard(span)
+            metrics.record(self.name, operation, method.__name__,
+                           (monotonic() - start) * 1000, _row_count(self))
+            return result
+        return wrapper
+    return decorator
+
+
+# background queries ##########################################################
+class DBQueryRunner(QtCore.QObject):
+    """Runs the queries of DB widgets off the GUI thread
+
+    - queries run in a thread pool, results come back to the GUI thread as signals
+    - only the latest request of a widget is delivered; superseded requests are
+    cancelled if they have not started, otherwise their result is dropped
+    - at most max_in_flight queries run per widget, newer requests wait and
+    only the newest waiting one is kept
+    """
+
+    _done = QtCore.pyqtSignal(int, object)
+
+    def __init__(self, max_workers=4, max_in_flight=1):
+        super().__init__()
+        self.max_workers = max_workers
+        self.max_in_flight = max_in_flight
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._next_id = 0
+        # owner -> latest request id / {request id: future} / waiting request
+        self._latest = {}
+        self._running = {}
+        self._waiting = {}
+        # request id -> (owner, on_result, on_error)
+        self._requests = {}
+        # owners whose destroyed signal is connected, kept until they are destroyed
+        self._wired = set()
+        self._done.connect(self._deliver)
+
+    def configure(self, max_workers=None, max_in_flight=None):
+        # change the pool size; queries already submitted finish on the old pool
+        if max_in_flight is not None:
+            self.max_in_flight = max_in_flight
+        if max_workers is not None and max_workers != self.max_workers:
+            self.max_workers = max_workers
+            self._executor.shutdown(wait=False)
+            self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def submit(self, owner, query, args=(), kwargs=None, on_result=None, on_error=None):
+        # run query(*args, **kwargs) for owner (a QObject); returns the request id
+        key = id(owner)
+        if key not in self._wired:
+            self._wired.add(key)
+            owner.destroyed.connect(lambda *_, key=key: self._destroyed(key))
+        self._next_id += 1
+        request_id = self._next_id
+        self._latest[key] = request_id
+        self._requests[request_id] = (key, on_result, on_error)
+
+        # older requests that have not started yet are not needed anymore
+        running = self._running.setdefault(key, {})
+        for future in list(running.values()):
+            future.cancel()
+        if key in self._waiting:
+            self._requests.pop(self._waiting.pop(key)[0], None)
+
+        request = (request_id, query, args, kwargs or {})
+        if len(running) >= self.max_in_flight:
+            self._waiting[key] = request
+        else:
+            self._start(key, request)
+        return request_id
+
+    def run(self, task, args=(), kwargs=None, on_result=None, on_error=None):
+        # run a task that later requests do not supersede, e.g. a file export;
+        # its result is always delivered
+        self._next_id += 1
+        request_id = self._next_id
+        self._requests[request_id] = (None, on_result, on_error)
+        future = self._executor.submit(task, *args, **(kwargs or {}))
+        future.add_done_callback(lambda f, request_id=request_id: self._done.emit(request_id, f))
+        return request_id
+
+    def cancel(self, owner):
+        # drop all requests of owner; running queries finish but are not delivered
+        self._forget(id(owner))
+
+    def is_busy(self, owner):
+        key = id(owner)
+        return bool(self._running.get(key)) or key in self._waiting
+
+    def _start(self, key, request):
+        request_id, query, args, kwargs = request
+        future = self._executor.submit(query, *args, **kwargs)
+        self._running.setdefault(key, {})[request_id] = future
+        # runs in the worker thread (or here when cancelled); the signal is
+        # queued to the GUI thread
+        future.add_done_callback(lambda f, request_id=request_id: self._done.emit(request_id, f))
+
+    def _destroyed(self, key):
+        self._wired.discard(key)
+        self._forget(key)
+
+    def _forget(self, key):
+        for future in self._running.pop(key, {}).values():
+            future.cancel()
+        self._waiting.pop(key, None)
+        self._latest.pop(key, None)
+        for request_id in [r for r, (k, _, _) in self._requests.items() if k == key]:
+            del self._requests[request_id]
+
+    def _deliver(self, request_id, future):
+        if request_id not in self._requests:
+            return
+        key, on_result, on_error = self._requests.pop(request_id)
+        self._running.get(key, {}).pop(request_id, None)
+
+        if not future.cancelled() and (key is None or self._latest.get(key) == request_id):
+            error = future.exception()
+            if error is None:
+                if on_result is not None:
+                    on_result(future.result())
+            elif on_error is not None:
+                on_error(error)
+            else:
+                logger.error('query %s failed: %s', request_id, error)
+
+        # a slot is free, start the request that waited for it
+        if key in self._waiting and len(self._running.get(key, {})) < self.max_in_flight:
+            self._start(key, self._waiting.pop(key))
+
+
+_query_runner = None
+
+
+def query_runner():
+    # the shared DBQueryRunner, created in the GUI thread on first use
+    global _query_runner
+    if _query_runner is None:
+        _query_runner = DBQueryRunner()
+    return _query_runner
+
+
+# signal coalescing ###########################################################
+# one frame at 60 Hz
+FRAME_MS = 16
+
+
+class DBSignalCoalescer(QtCore.QObject):
+    """Turns bursts of signal emissions into single deliveries
+
+    - values are pushed with push(*args) (connect a signal to it) and come out
+    of triggered(value); several args arrive as a tuple
+    - 'latest': the last value pushed within interval_ms is delivered at its end
+    (0 = next event loop turn)
+    - 'debounce': the last value is delivered once nothing was pushed for
+    interval_ms
+    - 'throttle': the first value is delivered right away, later ones at most
+    every interval_ms
+    - reduce(pending, value) combines the values instead of keeping the last,
+    e.g. operator.add to sum wheel steps
+    - nothing is delivered or kept while suppressed()
+    """
+
+    MODES = ('latest', 'debounce', 'throttle')
+
+    triggered = QtCore.pyqtSignal(object)
+
+    def __init__(self, mode='latest', interval_ms=FRAME_MS, reduce=None, parent=None):
+        super().__init__(parent)
+        self._timer = QtCore.QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._timeout)
+        self.configure(mode, interval_ms)
+        self.reduce = reduce
+        self._pending = False
+        self._value = None
+        self._suppressed = 0
+
+    def configure(self, mode=None, interval_ms=None):
+        if mode is not None:
+            if mode not in self.MODES:
+                raise ValueError('unknown mode: {}'.format(mode))
+            self.mode = mode
+        if interval_ms is not None:
+            self.interval_ms = interval_ms
+            self._timer.setInterval(interval_ms)
+
+    def push(self, *args):
+        if self._suppressed:
+            return
+        value = args[0] if len(args) == 1 else args
+        if self._pending and self.reduce is not None:
+            value = self.reduce(self._value, value)
+
+        if self.mode == 'throttle' and not self._timer.isActive():
+            # not cooling down, deliver now and start the cool down
+            self._pending = False
+            self._value = None
+            self._timer.start()
+            self.triggered.emit(value)
+            return
+
+        self._value = value
+        self._pending = True
+        if self.mode == 'debounce' or not self._timer.isActive():
+            self._timer.start()
+
+    def is_pending(self):
+        return self._pending
+
+    def flush(self):
+        # deliver a pending value now
+        self._timer.stop()
+        self._deliver()
+
+    def cancel(self):
+        self._timer.stop()
+        self._pending = False
+        self._value = None
+
+    @contextmanager
+    def suppressed(self):
+        # drop pushed values, e.g. while a widget is being filled
+        self._suppressed += 1
+        try:
+            yield self
+        finally:
+            self._suppressed -= 1
+
+    def _deliver(self):
+        if not self._pending:
+            return
+        value = self._value
+        self._pending = False
+        self._value = None
+        self.triggered.emit(value)
+
+    def _timeout(self):
+        if self.mode == 'throttle' and self._pending:
+            # the latest value of the cool down, then cool down again
+            self._timer.start()
+        self._deliver()
+
+
+def coalesce(signal, slot, mode='latest', interval_ms=FRAME_MS, reduce=None, parent=None):
+    # connect signal to slot through a DBSignalCoalescer, returned for
+    # flush / cancel / suppressed; parent owns it (e.g. the receiving widget)
+    coalescer = DBSignalCoalescer(mode, interval_ms, reduce, parent)
+    signal.connect(coalescer.push)
+    coalescer.triggered.connect(slot)
+    return coalescer
+
+
+# styles ######################################################################
+class DBStyleRegistry(object):
+    """One application stylesheet for the DB widgets, and shared fonts
+
+    - groupbox title colour and icon background are dynamic properties
+    (dbTitle, dbIconState) matched by rules of the application stylesheet,
+    so changing them re-polishes one widget instead of parsing a stylesheet
+    - property and font updates that change nothing are skipped
+    - fonts are cached by (font key, point size)
+    """
+
+    TITLE_RULES = ('QGroupBox[dbTitle="required"]::title {color: red;}\n'
+                   'QGroupBox[dbTitle="normal"]::title {color: black;}\n')
+
+    def __init__(self):
+        # background colour -> dbIconState value
+        self._icon_states = OrderedDict()
+        self._fonts = {}
+        self._installed_sheet = ''
+        self._dirty = True
+
+    def stylesheet(self):
+        rules = [self.TITLE_RULES]
+        for clr_txt, state in self._icon_states.items():
+            rules.append('QLabel[dbIconState="{}"] {{background-color: {};}}\n'.format(state, clr_txt))
+        return ''.join(rules)
+
+    def install(self):
+        # (re)apply our rules to the application, keeping its own rules;
+        # only happens when a new icon state shows up
+        app = QtGui.QApplication.instance()
+        if not self._dirty or app is None:
+            return
+        sheet = self.stylesheet()
+        base = app.styleSheet()
+        if self._installed_sheet and base.endswith(self._installed_sheet):
+            base = base[:-len(self._installed_sheet)]
+        app.setStyleSheet(base + sheet)
+        self._installed_sheet = sheet
+        self._dirty = False
+
+    def icon_state(self, clr_txt):
+        # property value of an icon background colour, registered on first use
+        if clr_txt not in self._icon_states:
+            self._icon_states[clr_txt] = 'state{}'.format(len(self._icon_states))
+            self._dirty = True
+        return self._icon_states[clr_txt]
+
+    def set_property(self, widget, name, value):
+        # set a style property and re-polish the widget if it changed
+        self.install()
+        if widget.property(name) == value:
+            return False
+        widget.setProperty(name, value)
+        widget.style().unpolish(widget)
+        widget.style().polish(widget)
+        widget.update()
+        return True
+
+    def font(self, base_font, font_size):
+        key = (base_font.key(), font_size)
+        if key not in self._fonts:
+            font = QtGui.QFont(base_font)
+            font.setPointSize(font_size)
+            self._fonts[key] = font
+        return self._fonts[key]
+
+    def set_font_size(self, widget, font_size):
+        # skips widgets already at font_size
+        if widget.font().pointSize() == font_size:
+            return False
+        widget.setFont(self.font(widget.font(), font_size))
+        return True
+
+
+style_registry = DBStyleRegistry()
+
+
 # base widget class with groupbox #############################################
+def _disconnect_all(obj):
+    # drop every connection to the signals of obj, except those of QObject
+    # (destroyed); each overload of a signal separately
+    meta = obj.metaObject()
+    for i in range(QtCore.QObject.staticMetaObject.methodCount(), meta.methodCount()):
+        method = meta.method(i)
+        if method.methodType() != QtCore.QMetaMethod.Signal:
+            continue
+        name, types = str(method.signature())[:-1].split('(', 1)
+        signal = getattr(obj, name, None)
+        if signal is None:
+            continue
+        try:
+            if types:
+                signal = signal[tuple(types.split(','))] if ',' in types else signal[types]
+            signal.disconnect()
+        except (TypeError, KeyError):
+            # nothing connected, or an overload not reachable from python
+            pass
+
+
 class DBWidget(QtGui.QWidget):
     """Class to make widgets used in EP GUIS
 
     Contains Groupbox with title methods, and layout to add items
+    A query callable can be bound to the widget with bind_query; refresh_query
+    runs it in the background and applies the result to the widget
+    get_state / restore_state save and apply the shown data for DBSession
     """
+
+    queryFinished = QtCore.pyqtSignal(object)
+    queryFailed = QtCore.pyqtSignal(object)
+
     def __init__(self, parent=None, name='dbicon'):
         super().__init__(parent)
         self.name = name
         self.setObjectName(self.name)
         self.vbox = QtGui.QVBoxLayout(self)
         self.box_layout = QtGui.QHBoxLayout()
+        self._query = None
+        self._context_menu = None
+        # signal name -> args of its last emission inside batch_update
+        self._deferred = None
 
         # add groupbox to widget
         self.init_groupbox()
@@ -53,39 +520,316 @@ class DBWidget(QtGui.QWidget):
         self.box_layout.addWidget(item)
 
     def increase_font(self, qt_item, font_size):
-        font = qt_item.font()
-        font.setPointSize(font_size)
-        qt_item.setFont(font)
+        style_registry.set_font_size(qt_item, font_size)
         return qt_item
 
     def update_title(self, lbl='UserInput', font_size=14, clear=True):
         # control title and font size of the groupbox; field reference name
-        if clear:
-            self.input_box.setTitle('')
+        # title colour comes from the application stylesheet, see DBStyleRegistry
         if lbl.endswith(' *'):
-            self.input_box.setStyleSheet('QGroupBox::title {color: red;}')
+            style_registry.set_property(self.input_box, 'dbTitle', 'required')
         else:
-            self.input_box.setStyleSheet('QGroupBox::title {color: black;}')
-        lbl = self.input_box.title() + lbl
+            style_registry.set_property(self.input_box, 'dbTitle', 'normal')
+        if not clear:
+            lbl = self.input_box.title() + lbl
 
-        self.input_box.setTitle(lbl)
+        if lbl != self.input_box.title():
+            self.input_box.setTitle(lbl)
         self.input_box = self.increase_font(self.input_box, font_size)
 
+    def clear_text(self):
+        # clear the shown data; widgets without data keep this no-op
+        pass
+
+    def focus_widget(self):
+        # child widget taking the focus
+        return self.input_values
+
+    def clear_text_and_set_focus(self):
+        self.clear_text()
+        self.focus_widget().setFocus()
+
+    def reset(self):
+        # clear data for the next session, the title and settings stay;
+        # widgets with more state extend it
+        # the query belongs to the form that bound it
+        if self._query is not None:
+            self.cancel_query()
+            self.bind_query(None)
+        self.clear_text()
+
+    def disconnect_signals(self):
+        # drop all connections to the signals declared by the DB widget classes
+        # and to the signals of the input widget, e.g. before the widget is
+        # reused by another form; the widget's own connections are made again
+        for cls in type(self).__mro__:
+            if cls.__module__ != __name__:
+                continue
+            for attr, value in vars(cls).items():
+                if isinstance(value, QtCore.pyqtSignal):
+                    try:
+                        getattr(self, attr).disconnect()
+                    except TypeError:
+                        # nothing connected
+                        pass
+        _disconnect_all(self.focus_widget())
+        self.connect_input_signals()
+
+    def connect_input_signals(self):
+        # connections of the widget to its input widget; widgets with such
+        # connections extend it
+        pass
+
+    def input_settings(self):
+        # read-only state, focus policy and font of the input widget, e.g. the
+        # constructor defaults that DBWidgetPool restores
+        input_widget = self.focus_widget()
+        is_read_only = getattr(input_widget, 'isReadOnly', None)
+        return {'read_only': is_read_only() if is_read_only is not None else None,
+                'focus': input_widget.focusPolicy(),
+                'font': QtGui.QFont(input_widget.font())}
+
+    def restore_input_settings(self, settings):
+        input_widget = self.focus_widget()
+        if settings['read_only'] is not None and hasattr(self, 'setReadOnly'):
+            self.setReadOnly(settings['read_only'])
+        input_widget.setFocusPolicy(settings['focus'])
+        input_widget.setFont(settings['font'])
+
+    def bind_query(self, query):
+        # query is a callable returning the data for apply_query_result
+        self._query = query
+
+    def refresh_query(self, *args, **kwargs):
+        # run the bound query in the background with new arguments (e.g. filter);
+        # a result of an older refresh still running is dropped
+        if self._query is None:
+            raise RuntimeError('{}: no query bound'.format(self.name))
+        return query_runner().submit(self, self._query, args, kwargs,
+                                     self._query_result, self._query_error)
+
+    def cancel_query(self):
+        query_runner().cancel(self)
+
+    def apply_query_result(self, result):
+        # fill the widget with a query result; ignored by widgets that show none
+        pass
+
+    def _query_result(self, result):
+        self.apply_query_result(result)
+        self._emit('queryFinished', result)
+
+    def _query_error(self, error):
+        logger.error('%s: query failed: %s', self.name, error)
+        self._emit('queryFailed', error)
+
+    def _emit(self, signal, *args):
+        # emit the signal of this name now, or its last emission once at the
+        # end of batch_update
+        if self._deferred is None:
+            getattr(self, signal).emit(*args)
+            return
+        self._deferred.pop(signal, None)
+        self._deferred[signal] = args
+
+    def batch_update(self):
+        # see batch_update below
+        return batch_update(self)
+
+    def context_menu(self):
+        # context menu of the widget, made once and reused for every popup
+        if self._context_menu is None:
+            self._context_menu = QtGui.QMenu(self)
+        return self._context_menu
+
+    def add_context_action(self, text, slot):
+        # action of the context menu, connected to slot once
+        action = self.context_menu().addAction(text)
+        action.triggered.connect(slot)
+        return action
+
+    def get_state(self):
+        # json serialisable state for a session snapshot; empty for widgets
+        # without state of their own
+        return {}
+
+    def restore_state(self, state):
+        # apply a state of get_state
+        pass
+
+    def resync(self):
+        # bring restored data up to date in the background
+        if self._query is not None:
+            self.refresh_query()
+
+    def memory_usage(self):
+        # what the widget holds: rows and cells of its data, pixmap data and
+        # child objects (menus, actions, views, ...); widgets with more data add
+        # their own entries
+        return {'name': self.name, 'type': type(self).__name__, 'rows': _row_count(self) or 0,
+                'cells': 0, 'pixmap_kb': 0, 'children': len(self.findChildren(QtCore.QObject))}
+
+
+def _current_value(widget):
+    # value shown by a DB widget, None for widgets without one
+    current_value = getattr(widget, 'current_value', None)
+    return current_value() if current_value is not None else None
+
+
+@contextmanager
+def batch_update(root):
+    # fill many DB widgets at once: repaint of root and the signals of root and
+    # the DB widgets in it are suspended until the end, then layout and paint
+    # run once. yields a dict that is filled at the end with the current value
+    # of each widget that changed, by object name. The signals of the DB
+    # widget classes (itemsAdded, queryFinished, loadFinished, ...) are held
+    # back and their last emission arrives once after the block; other
+    # signals of the widgets are dropped meanwhile
+    widgets = root.findChildren(DBWidget)
+    if isinstance(root, DBWidget):
+        widgets.insert(0, root)
+    before = [_current_value(widget) for widget in widgets]
+    # nested batches leave the deferred signals to the outer one
+    deferring = [widget for widget in widgets if widget._deferred is None]
+    for widget in deferring:
+        widget._deferred = OrderedDict()
+    blocked = [widget.blockSignals(True) for widget in widgets]
+    updates = root.updatesEnabled()
+    root.setUpdatesEnabled(False)
+
+    changed = OrderedDict()
+    try:
+        yield changed
+    finally:
+        for widget, state in zip(widgets, blocked):
+            widget.blockSignals(state)
+        # nested batches leave the repaint to the outer one
+        root.setUpdatesEnabled(updates)
+        if updates:
+            if root.layout() is not None:
+                root.layout().activate()
+            root.update()
+        for widget, value in zip(widgets, before):
+            current = _current_value(widget)
+            if current != value:
+                changed[widget.objectName()] = current
+        for widget in deferring:
+            deferred, widget._deferred = widget._deferred, None
+            for signal, args in deferred.items():
+                widget._emit(signal, *args)
+
+
+# pixmap cache ################################################################
+IMAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'images')
+ICONS = {
+    'ok': os.path.join(IMAGE_DIR, 'ok-32.png'),
+    'add': os.path.join(IMAGE_DIR, 'plus-32.png'),
+    'qr': os.path.join(IMAGE_DIR, 'qrcode-32.png'),
+}
+
+
+class DBPixmapCache(object):
+    """Process-wide cache of decoded pixmaps
+
+    - pixmaps are keyed by (path, size, state); each file is read and decoded once
+    - scaled sizes and icon states (normal, disabled, active, selected) are made
+    from the cached original
+    - the cache holds at most limit_kb of pixmap data; the least recently used
+    pixmaps are dropped first
+    """
+
+    STATES = {
+        'normal': QtGui.QIcon.Normal,
+        'disabled': QtGui.QIcon.Disabled,
+        'active': QtGui.QIcon.Active,
+        'selected': QtGui.QIcon.Selected,
+    }
+
+    def __init__(self, limit_kb=8192):
+        self.limit_kb = limit_kb
+        self._pixmaps = OrderedDict()
+        self._cost_kb = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _cost(pixmap):
+        return pixmap.width() * pixmap.height() * pixmap.depth() // 8192
+
+    def pixmap(self, path, size=None, state=None):
+        # size is (width, height), state a key of STATES
+        key = (path, tuple(size) if size else None, state)
+        pixmap = self._pixmaps.get(key)
+        if pixmap is not None:
+            self._pixmaps.move_to_end(key)
+            self.hits += 1
+            return pixmap
+
+        self.misses += 1
+        if size is None and state is None:
+            pixmap = QtGui.QPixmap(path)
+        else:
+            pixmap = self.pixmap(path)
+            if size:
+                pixmap = pixmap.scaled(QtCore.QSize(*size), QtCore.Qt.KeepAspectRatio,
+                                       QtCore.Qt.SmoothTransformation)
+            if state:
+                pixmap = QtGui.QIcon(pixmap).pixmap(pixmap.size(), self.STATES[state])
+        self._insert(key, pixmap)
+        return pixmap
+
+    def icon_pixmap(self, name, size=None, state=None):
+        # pixmap of an icon in ICONS
+        return self.pixmap(ICONS[name], size, state)
+
+    def preload(self, names, sizes=(None,), states=(None,)):
+        # decode and scale icons ahead of building the forms
+        for name, size, state in itertools.product(names, sizes, states):
+            self.icon_pixmap(name, size, state)
+
+    def _insert(self, key, pixmap):
+        self._pixmaps[key] = pixmap
+        self._cost_kb += self._cost(pixmap)
+        while self._cost_kb > self.limit_kb and len(self._pixmaps) > 1:
+            _, dropped = self._pixmaps.popitem(last=False)
+            self._cost_kb -= self._cost(dropped)
+
+    def clear(self):
+        self._pixmaps.clear()
+        self._cost_kb = 0
+
+    def stats(self):
+        return {'pixmaps': len(self._pixmaps), 'kb': self._cost_kb,
+                'hits': self.hits, 'misses': self.misses}
+
+
+pixmap_cache = DBPixmapCache()
+
 
 class DBExtendedLabel(QtGui.QLabel):
     """Class to make clickable label
 
+    - scroll emits the wheel steps of a frame as one summed delta; the
+    coalescer is made on the first wheel event, most labels never scroll
     """
     clicked = QtCore.pyqtSignal()
     scroll = QtCore.pyqtSignal(int)
     def __init__(self, parent):
         super().__init__(parent)
+        self.scroll_coalescer = None
 
     def mouseReleaseEvent(self, ev):
         self.clicked.emit()
 
     def wheelEvent(self, ev):
-        self.scroll.emit(ev.delta())
+        if self.scroll_coalescer is None:
+            self.scroll_coalescer = DBSignalCoalescer('latest', FRAME_MS, operator.add, self)
+            self.scroll_coalescer.triggered.connect(self.scroll.emit)
+        self.scroll_coalescer.push(ev.delta())
+
+    def set_image(self, path, size=None):
+        # show an image file through the shared pixmap cache
+        self.setPixmap(pixmap_cache.pixmap(path, size))
 
 
 class DBButtonGroup(QtGui.QButtonGroup):
@@ -100,11 +844,14 @@ class DBButtonGroup(QtGui.QButtonGroup):
 class DBIcon(QtGui.QWidget):
     """Class to display all the relevant icons
 
-    - icons are placed in the same folder.
+    - icons are placed in the images folder, see ICONS.
     - class can inherited sevral times
+    - pixmaps come from the shared pixmap_cache; icon_size=(w, h) uses a
+    pre-scaled copy
     """
 
-    def __init__(self, parent=None, name='dbicon', set_icon='ok', set_state='rgb(166, 206, 227)'):
+    def __init__(self, parent=None, name='dbicon', set_icon='ok', set_state='rgb(166, 206, 227)',
+                 icon_size=None):
         super().__init__(parent)
         self.name = name
         self.setObjectName(self.name)
@@ -112,11 +859,9 @@ class DBIcon(QtGui.QWidget):
 
         self.set_icon = set_icon
         self.set_state = set_state
-        self.icons = {
-            'ok': '..\images\ok-32.png',
-            'add': '..\images\plus-32.png',
-            'qr': '..\images\qrcode-32.png'
-        }
+        self.initial_state = set_state
+        self.icon_size = icon_size
+        self.icons = ICONS
 
         self.init_icon()
 
@@ -124,9 +869,9 @@ class DBIcon(QtGui.QWidget):
         """Lineedit with groupbox used to display field name"""
 
         self.icon_label = DBExtendedLabel(self)
-        self.icon_label.setStyleSheet("background-color: {}".format(self.set_state))
-        self.icon_pixmap = QtGui.QPixmap(os.path.join(os.path.dirname(os.path.abspath(__file__)),
-                                                      self.icons[self.set_icon]))
+        style_registry.set_property(self.icon_label, 'dbIconState',
+                                    style_registry.icon_state(self.set_state))
+        self.icon_pixmap = pixmap_cache.pixmap(self.icons[self.set_icon], self.icon_size)
         self.icon_label.setPixmap(self.icon_pixmap)
         self.icon_label.setMaximumHeight(self.icon_pixmap.width())
         self.icon_label.setMaximumWidth(self.icon_pixmap.height())
@@ -135,8 +880,29 @@ class DBIcon(QtGui.QWidget):
         self.vbox.addWidget(self.icon_label)
 
     def set_icon_state(self, state_txt='rgb(166, 206, 227)'):
+        # state_txt is the background colour; unchanged states cost nothing
         self.set_state = state_txt
-        self.icon_label.setStyleSheet("background-color : " + self.set_state)
+        style_registry.set_property(self.icon_label, 'dbIconState',
+                                    style_registry.icon_state(self.set_state))
+
+    def reset(self):
+        # back to the state the icon was created with
+        self.set_icon_state(self.initial_state)
+
+    def get_state(self):
+        return {'state': self.set_state}
+
+    def restore_state(self, state):
+        self.set_icon_state(state['state'])
+
+    def resync(self):
+        pass
+
+    def memory_usage(self):
+        # the pixmap is shared through pixmap_cache
+        return {'name': self.name, 'type': type(self).__name__, 'rows': 0, 'cells': 0,
+                'pixmap_kb': DBPixmapCache._cost(self.icon_pixmap),
+                'children': len(self.findChildren(QtCore.QObject))}
 
         # def set_icon_scaling(self, scale=(30,30)):
         #     self.icon_pixmap.scaled(QtCore.QSize(scale[0], scale[1]), QtCore.Qt.KeepAspectRatio)
@@ -156,10 +922,9 @@ class MainUI(QtGui.QWidget):
     def initButton(self):
         self.ImageButton = DBExtendedLabel(self)
         self.ImageButton.move(0, 0)
-        print(os.path.join(os.path.dirname(os.path.abspath(__file__)),
-                                                              'ok-32.png'))
-        self.ImageButton.setPixmap(QtGui.QPixmap(os.path.join(os.path.dirname(os.path.abspath(__file__)),
-                                                              'ok-32.png')))
+        image_path = os.path.join(IMAGE_DIR, self.BUTTON_IMAGE)
+        print(image_path)
+        self.ImageButton.set_image(image_path)
         self.ImageButton.setScaledContents(True)
 
     def buttonClicked(self):
@@ -171,6 +936,1561 @@ class MainUI(QtGui.QWidget):
         self.resize(self.ImageButton.size())
 
 
+# table view ##################################################################
+class DBTableView(QtGui.QTableView):
+    """Table view of DBTable
+
+    - repaints are timed in the metrics registry when it is enabled
+    """
+
+    def __init__(self, owner):
+        super().__init__(owner)
+        # the view is reparented into the groupbox, keep the DBTable for its name
+        self.owner = owner
+
+    def paintEvent(self, event):
+        if not metrics.enabled:
+            return super().paintEvent(event)
+        start = monotonic()
+        super().paintEvent(event)
+        metrics.record(self.owner.name, 'repaint', 'paintEvent',
+                       (monotonic() - start) * 1000, _row_count(self.owner))
+
+
+# table models ################################################################
+# row states of DBTable and their background colour; None keeps the default.
+# any other state name is taken as the colour itself, e.g. 'red'
+ROW_STATES = {
+    'valid': None,
+    'invalid': 'red',
+    'pending': 'rgb(255, 235, 156)',
+}
+# role holding the state name of a row
+ROW_STATE_ROLE = QtCore.Qt.UserRole + 1
+
+_row_state_brushes = {}
+
+
+def register_row_state(state, clr_txt):
+    # add or recolour a row state
+    ROW_STATES[state] = clr_txt
+    _row_state_brushes.pop(state, None)
+
+
+def row_state_brush(state):
+    # brush shared by all rows in the state, made on first use
+    if state is None:
+        return None
+    if state not in _row_state_brushes:
+        clr_txt = ROW_STATES.get(state, state)
+        _row_state_brushes[state] = QtGui.QBrush(QtGui.QColor(clr_txt)) if clr_txt else None
+    return _row_state_brushes[state]
+
+
+# above this many separate ranges, remove_rows resets the model instead of
+# notifying every range
+BULK_REMOVE_RANGES = 50
+# above this many separate ranges, a row state change is notified as one span
+BULK_NOTIFY_RANGES = 50
+
+
+def _row_ranges(rows):
+    # coalesce row numbers into sorted (first, last) ranges of contiguous rows
+    ranges = []
+    for row in sorted(set(rows)):
+        if ranges and row == ranges[-1][1] + 1:
+            ranges[-1][1] = row
+        else:
+            ranges.append([row, row])
+    return [tuple(r) for r in ranges]
+
+
+def _keep_mask(ranges, count):
+    # one byte per row of count rows, 0 for the rows in ranges
+    keep = bytearray(b'\x01') * count
+    for first, last in ranges:
+        keep[first:last + 1] = bytearray(last - first + 1)
+    return keep
+
+
+def _notify_ranges(rows):
+    # (first, last) ranges of rows for dataChanged; many scattered ranges are
+    # merged into a single span
+    ranges = _row_ranges(rows)
+    if len(ranges) > BULK_NOTIFY_RANGES:
+        return [(ranges[0][0], ranges[-1][1])]
+    return ranges
+
+
+def _state_data_changed(model, rows, last_col):
+    # dataChanged for rows whose state changed; model.updating_states is set
+    # meanwhile, so listeners can tell that no value changed
+    model.updating_states = True
+    try:
+        for first, last in _notify_ranges(rows):
+            model.dataChanged.emit(model.index(first, 0), model.index(last, last_col))
+    finally:
+        model.updating_states = False
+
+
+class DBStandardItemModel(QtGui.QStandardItemModel):
+    """Default model of DBTable
+
+    - one QStandardItem per cell, same as a plain QStandardItemModel
+    - row helpers are shared with DBTableModel so DBTable can use either model
+    - row states are kept per row and coloured in data(), not on the items
+    """
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        # state of each row, follows the rows through the model signals
+        self._row_states = []
+        self._state_persistent = []
+        # remove_rows carries the states itself
+        self._bulk_removal = False
+        # True while dataChanged is only about row states
+        self.updating_states = False
+        self.rowsInserted.connect(self._states_inserted)
+        self.rowsRemoved.connect(self._states_removed)
+        self.modelReset.connect(self._states_reset)
+        self.layoutAboutToBeChanged.connect(self._states_about_to_move)
+        self.layoutChanged.connect(self._states_moved)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if role in (QtCore.Qt.BackgroundRole, ROW_STATE_ROLE) and index.isValid():
+            state = self.row_state(index.row())
+            return row_state_brush(state) if role == QtCore.Qt.BackgroundRole else state
+        return super().data(index, role)
+
+    def _states_inserted(self, parent, first, last):
+        self._row_states[first:first] = [None] * (last - first + 1)
+
+    def _states_removed(self, parent, first, last):
+        del self._row_states[first:last + 1]
+
+    def _states_reset(self):
+        self._row_states = [None] * self.rowCount()
+
+    def _states_about_to_move(self):
+        # rows may be reordered (sort); keep the states on persistent indexes
+        if self._bulk_removal:
+            return
+        self._state_persistent = [(QtCore.QPersistentModelIndex(self.index(row, 0)), state)
+                                  for row, state in enumerate(self._row_states)
+                                  if state is not None]
+
+    def _states_moved(self):
+        if self._bulk_removal:
+            return
+        self._row_states = [None] * self.rowCount()
+        for index, state in self._state_persistent:
+            if index.isValid():
+                self._row_states[index.row()] = state
+        self._state_persistent = []
+
+    def cell_value(self, row, col):
+        # value stored in the cell, items only keep the text
+        item = self.item(row, col)
+        if item is None:
+            return None
+        return item.text()
+
+    def cell_text(self, row, col):
+        # text shown in the cell
+        item = self.item(row, col)
+        if item is None:
+            return ''
+        return item.text()
+
+    def row_values(self, row):
+        return [self.cell_value(row, c) for c in range(self.columnCount())]
+
+    def column_values(self, col, first=0, last=None):
+        # values of rows first..last (inclusive) in column col
+        if last is None:
+            last = self.rowCount() - 1
+        return [self.cell_value(row, col) for row in range(first, last + 1)]
+
+    def column_snapshot(self):
+        # values of all columns, for reading outside the GUI thread
+        # the items can only be read here, so every cell is copied on the GUI
+        # thread before the worker starts; use the virtual model to export or
+        # save large tables
+        return [self.column_values(col) for col in range(self.columnCount())]
+
+    def find_row(self, value, col=0):
+        # first row with value in column col, -1 if not found
+        item_exists = self.findItems(str(value), column=col)
+        if len(item_exists) == 0:
+            return -1
+        return item_exists[0].row()
+
+    def append_row(self, row_list):
+        self.appendRow([QtGui.QStandardItem(str(i)) for i in row_list])
+
+    def set_row(self, row, row_list):
+        for c, i in enumerate(row_list):
+            self.setItem(row, c, QtGui.QStandardItem(str(i)))
+
+    def append_rows(self, rows):
+        # one insert notification for all rows instead of one per row;
+        # the per-row notifications of appendRow are blocked
+        if not rows:
+            return
+        # new columns are announced before the signals are blocked
+        width = max(len(row_list) for row_list in rows)
+        if width > self.columnCount():
+            self.setColumnCount(width)
+        first = self.rowCount()
+        self.beginInsertRows(QtCore.QModelIndex(), first, first + len(rows) - 1)
+        self.blockSignals(True)
+        try:
+            for row_list in rows:
+                self.append_row(row_list)
+        finally:
+            self.blockSignals(False)
+            self.endInsertRows()
+
+    def replace_rows(self, rows):
+        self.beginResetModel()
+        self.blockSignals(True)
+        try:
+            self.removeRows(0, self.rowCount())
+            for row_list in rows:
+                self.append_row(row_list)
+        finally:
+            self.blockSignals(False)
+            self.endResetModel()
+
+    def set_rows(self, updates):
+        # updates is a list of (row, row_list); one dataChanged per contiguous range
+        if not updates:
+            return
+        width = max(len(row_list) for _, row_list in updates)
+        if width > self.columnCount():
+            self.setColumnCount(width)
+        self.blockSignals(True)
+        try:
+            for row, row_list in updates:
+                for c, i in enumerate(row_list):
+                    item = self.item(row, c)
+                    if item is None:
+                        self.setItem(row, c, QtGui.QStandardItem(str(i)))
+                    else:
+                        item.setText(str(i))
+        finally:
+            self.blockSignals(False)
+        last_col = self.columnCount() - 1
+        for first, last in _row_ranges(row for row, _ in updates):
+            self.dataChanged.emit(self.index(first, 0), self.index(last, last_col))
+
+    def remove_rows(self, rows):
+        # remove rows (any order), one removeRows per contiguous range from the
+        # bottom up; returns the ranges
+        ranges = _row_ranges(rows)
+        if len(ranges) <= BULK_REMOVE_RANGES:
+            for first, last in reversed(ranges):
+                self.removeRows(first, last - first + 1)
+            return ranges
+
+        # scattered rows: removed as one layout change, so the selection and
+        # other persistent indexes follow their rows; the row states are kept
+        # for the rows that stay
+        keep = _keep_mask(ranges, self.rowCount())
+        self._bulk_removal = True
+        try:
+            self.layoutAboutToBeChanged.emit()
+            self.blockSignals(True)
+            try:
+                for first, last in reversed(ranges):
+                    self.removeRows(first, last - first + 1)
+            finally:
+                self.blockSignals(False)
+            self._row_states = list(itertools.compress(self._row_states, keep))
+            self.layoutChanged.emit()
+        finally:
+            self._bulk_removal = False
+        return ranges
+
+    def row_state(self, row):
+        if 0 <= row < len(self._row_states):
+            return self._row_states[row]
+        return None
+
+    def set_row_states(self, rows, state):
+        # colours come from the state palette in data(); dataChanged only for
+        # the rows whose state changed
+        states = self._row_states
+        changed = [row for row in rows if states[row] != state]
+        for row in changed:
+            states[row] = state
+        last_col = self.columnCount() - 1
+        _state_data_changed(self, changed, last_col)
+
+
+class DBTableModel(QtCore.QAbstractTableModel):
+    """Virtual model of DBTable
+
+    - rows are kept as lists of the raw values, one list per column
+    - no item objects per cell; display strings are made in data() on paint
+    - same row helpers as DBStandardItemModel
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._headers = []
+        self._columns = []
+        self._row_states = []
+        self._row_count = 0
+        # True while dataChanged is only about row states
+        self.updating_states = False
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self._row_count
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._columns)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == QtCore.Qt.DisplayRole:
+            return self.cell_text(index.row(), index.column())
+        if role == QtCore.Qt.BackgroundRole:
+            return row_state_brush(self._row_states[index.row()])
+        if role == ROW_STATE_ROLE:
+            return self._row_states[index.row()]
+        return None
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if (role == QtCore.Qt.DisplayRole and orientation == QtCore.Qt.Horizontal
+                and section < len(self._headers)):
+            return self._headers[section]
+        return super().headerData(section, orientation, role)
+
+    def setHorizontalHeaderLabels(self, header_list):
+        self._headers = [str(h) for h in header_list]
+        self._ensure_columns(len(self._headers))
+        if self._headers:
+            self.headerDataChanged.emit(QtCore.Qt.Horizontal, 0, len(self._headers) - 1)
+
+    def removeRows(self, row, count, parent=QtCore.QModelIndex()):
+        if parent.isValid() or count <= 0 or row < 0 or row + count > self._row_count:
+            return False
+        self.beginRemoveRows(QtCore.QModelIndex(), row, row + count - 1)
+        for column in self._columns:
+            del column[row:row + count]
+        del self._row_states[row:row + count]
+        self._row_count -= count
+        self.endRemoveRows()
+        return True
+
+    def set_columns(self, headers, columns):
+        # use columns (sequences of equal length, e.g. snapshot columns) as storage
+        self.beginResetModel()
+        self._headers = [str(h) for h in headers]
+        self._set_storage(list(columns))
+        self._row_count = len(self._columns[0]) if self._columns else 0
+        self._row_states = [None] * self._row_count
+        while len(self._columns) < len(self._headers):
+            self._columns.append([None] * self._row_count)
+        self.endResetModel()
+
+    def clear(self):
+        # remove rows and headers, same as QStandardItemModel.clear
+        self.beginResetModel()
+        self._headers = []
+        self._set_storage([])
+        self._row_states = []
+        self._row_count = 0
+        self.endResetModel()
+
+    def _ensure_columns(self, count):
+        # grow the column storage, new cells are empty
+        current = len(self._columns)
+        if count <= current:
+            return
+        self.beginInsertColumns(QtCore.QModelIndex(), current, count - 1)
+        for _ in range(count - current):
+            self._columns.append([None] * self._row_count)
+        self.endInsertColumns()
+
+    def cell_value(self, row, col):
+        return self._columns[col][row]
+
+    def cell_text(self, row, col):
+        # '' outside the table, like an empty cell
+        if not (0 <= row < self._row_count and 0 <= col < len(self._columns)):
+            return ''
+        value = self._columns[col][row]
+        if value is None:
+            return ''
+        return str(value)
+
+    def row_values(self, row):
+        return [column[row] for column in self._columns]
+
+    def column_values(self, col, first=0, last=None):
+        # values of rows first..last (inclusive) in column col
+        if last is None:
+            last = self._row_count - 1
+        return self._columns[col][first:last + 1]
+
+    def storage_usage(self):
+        # size of the column lists (references only, values are shared) and
+        # number of columns still read from a snapshot file
+        mapped = [isinstance(column, DBMappedColumn) and column.is_mapped() for column in self._columns]
+        return {'storage_kb': sum(sys.getsizeof(column) for column, m in zip(self._columns, mapped)
+                                  if not m) // 1024,
+                'mapped_columns': sum(mapped)}
+
+    def column_snapshot(self):
+        # columns for reading outside the GUI thread; lists are copied (values
+        # are shared), columns still in a snapshot file are detached copies that
+        # close_columns releases when done
+        return [column.detached() if isinstance(column, DBMappedColumn) else column[:]
+                for column in self._columns]
+
+    def release_file(self, path):
+        # copy the columns mapped from the snapshot file path into lists, so the
+        # file can be replaced
+        for column in self._columns:
+            if isinstance(column, DBMappedColumn) and column.maps(path):
+                column._materialize()
+
+    def _set_storage(self, columns):
+        # replace the column storage, unmapping snapshot columns that are dropped
+        kept = {id(column) for column in columns}
+        close_columns(column for column in self._columns if id(column) not in kept)
+        self._columns = columns
+
+    def find_row(self, value, col=0):
+        # first row with value in column col, -1 if not found
+        txt = str(value)
+        for row, cell in enumerate(self._columns[col] if col < len(self._columns) else []):
+            if cell is not None and str(cell) == txt:
+                return row
+        return -1
+
+    def append_row(self, row_list):
+        self._ensure_columns(len(row_list))
+        row = self._row_count
+        self.beginInsertRows(QtCore.QModelIndex(), row, row)
+        for c, column in enumerate(self._columns):
+            column.append(row_list[c] if c < len(row_list) else None)
+        self._row_states.append(None)
+        self._row_count += 1
+        self.endInsertRows()
+
+    def set_row(self, row, row_list):
+        self._ensure_columns(len(row_list))
+        for c, i in enumerate(row_list):
+            self._columns[c][row] = i
+        self.dataChanged.emit(self.index(row, 0), self.index(row, len(self._columns) - 1))
+
+    def _extend_columns(self, rows):
+        # store rows at the end of the column lists
+        for c, column in enumerate(self._columns):
+            column.extend(row_list[c] if c < len(row_list) else None for row_list in rows)
+        self._row_states.extend([None] * len(rows))
+        self._row_count += len(rows)
+
+    def append_rows(self, rows):
+        # all rows in a single insert notification
+        if not rows:
+            return
+        self._ensure_columns(max(len(row_list) for row_list in rows))
+        first = self._row_count
+        self.beginInsertRows(QtCore.QModelIndex(), first, first + len(rows) - 1)
+        self._extend_columns(rows)
+        self.endInsertRows()
+
+    def replace_rows(self, rows):
+        self.beginResetModel()
+        width = max([len(self._headers)] + [len(row_list) for row_list in rows])
+        self._set_storage([[] for _ in range(width)])
+        self._row_states = []
+        self._row_count = 0
+        self._extend_columns(rows)
+        self.endResetModel()
+
+    def set_rows(self, updates):
+        # updates is a list of (row, row_list); one dataChanged per contiguous range
+        if not updates:
+            return
+        self._ensure_columns(max(len(row_list) for _, row_list in updates))
+        for row, row_list in updates:
+            for c, i in enumerate(row_list):
+                self._columns[c][row] = i
+        last_col = len(self._columns) - 1
+        for first, last in _row_ranges(row for row, _ in updates):
+            self.dataChanged.emit(self.index(first, 0), self.index(last, last_col))
+
+    def remove_rows(self, rows):
+        # remove rows (any order), one removeRows per contiguous range from the
+        # bottom up; returns the ranges
+        ranges = _row_ranges(rows)
+        if len(ranges) <= BULK_REMOVE_RANGES:
+            for first, last in reversed(ranges):
+                self.removeRows(first, last - first + 1)
+            return ranges
+
+        # scattered rows: one pass over the storage as a layout change, so the
+        # selection and other persistent indexes follow their rows
+        keep = _keep_mask(ranges, self._row_count)
+        # new row + 1 of every old row that is kept
+        new_rows = list(itertools.accumulate(keep))
+        self.layoutAboutToBeChanged.emit()
+        persistent = self.persistentIndexList()
+        self._columns = [list(itertools.compress(column, keep)) for column in self._columns]
+        self._row_states = list(itertools.compress(self._row_states, keep))
+        self._row_count = len(self._row_states)
+        self.changePersistentIndexList(
+            persistent, [self.index(new_rows[index.row()] - 1, index.column())
+                         if keep[index.row()] else QtCore.QModelIndex() for index in persistent])
+        self.layoutChanged.emit()
+        return ranges
+
+    def row_state(self, row):
+        return self._row_states[row]
+
+    def set_row_states(self, rows, state):
+        # colours come from the state palette in data(); dataChanged only for
+        # the rows whose state changed
+        states = self._row_states
+        changed = [row for row in rows if states[row] != state]
+        for row in changed:
+            states[row] = state
+        last_col = len(self._columns) - 1
+        _state_data_changed(self, changed, last_col)
+
+
+# table snapshots #############################################################
+# binary snapshot of a table, column by column:
+#   magic | per column: json cells, one after the other | cell offsets (uint64)
+#   | json header | header position (uint64) | magic
+SNAPSHOT_MAGIC = b'DBSNAP01'
+SNAPSHOT_VERSION = 1
+
+
+def _encode_cell(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+
+
+def _export_rows(columns, rows=None):
+    # rows as tuples; rows is a list of row numbers, None for all rows
+    if rows is None:
+        return zip(*columns)
+    return (tuple(column[row] for column in columns) for row in rows)
+
+
+def write_csv(path, headers, columns, rows=None):
+    # stream the rows to a csv file; returns the number of rows written
+    # the file is written next to path and moved over it when complete
+    count = 0
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        if headers:
+            writer.writerow(headers)
+        for row in _export_rows(columns, rows):
+            writer.writerow(row)
+            count += 1
+    os.replace(tmp_path, path)
+    return count
+
+
+def write_snapshot(path, headers, columns, rows=None):
+    # stream the columns to a snapshot file; returns the number of rows written
+    # the file is written next to path and moved over it when complete, so a
+    # snapshot that is still mapped keeps its data
+    tmp_path = path + '.tmp'
+    count = 0
+    positions = []
+    with open(tmp_path, 'wb', buffering=1 << 20) as f:
+        f.write(SNAPSHOT_MAGIC)
+        for column in columns:
+            values = column if rows is None else (column[row] for row in rows)
+            offsets = array('Q', [0])
+            end = 0
+            blob_pos = f.tell()
+            for value in values:
+                cell = _encode_cell(value)
+                f.write(cell)
+                end += len(cell)
+                offsets.append(end)
+            if sys.byteorder != 'little':
+                offsets.byteswap()
+            offsets_pos = f.tell()
+            f.write(offsets.tobytes())
+            positions.append((blob_pos, offsets_pos))
+            count = len(offsets) - 1
+
+        header_pos = f.tell()
+        f.write(json.dumps({'version': SNAPSHOT_VERSION, 'headers': [str(h) for h in headers],
+                            'rows': count, 'columns': positions}).encode('utf-8'))
+        f.write(struct.pack('<Q', header_pos))
+        f.write(SNAPSHOT_MAGIC)
+    os.replace(tmp_path, path)
+    return count
+
+
+def read_snapshot(path):
+    # headers and DBMappedColumns of a snapshot file; cells are read from the
+    # memory map when they are used
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    mapped = _SnapshotMap(path, data)
+    tail = len(SNAPSHOT_MAGIC) + 8
+    if (len(data) < len(SNAPSHOT_MAGIC) + tail or data[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC
+            or data[-len(SNAPSHOT_MAGIC):] != SNAPSHOT_MAGIC):
+        mapped.close()
+        raise ValueError('not a table snapshot: {}'.format(path))
+
+    header_pos = struct.unpack_from('<Q', data, len(data) - tail)[0]
+    header = json.loads(data[header_pos:len(data) - tail].decode('utf-8'))
+    if header['version'] != SNAPSHOT_VERSION:
+        mapped.close()
+        raise ValueError('unsupported snapshot version {}: {}'.format(header['version'], path))
+
+    columns = [DBMappedColumn(mapped, blob_pos, offsets_pos, header['rows'])
+               for blob_pos, offsets_pos in header['columns']]
+    if not columns:
+        mapped.close()
+    return header['headers'], columns
+
+
+def close_columns(columns):
+    # unmap the DBMappedColumns among columns (e.g. a column_snapshot that was
+    # written); other columns are left alone
+    for column in columns:
+        if isinstance(column, DBMappedColumn):
+            column.close()
+
+
+class _SnapshotMap(object):
+    # memory map of a snapshot file shared by its columns; unmapped when the
+    # last column using it is closed (the file can then be replaced, also on
+    # Windows)
+
+    def __init__(self, path, data):
+        self.path = os.path.abspath(path)
+        self.data = data
+        self._users = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            self._users += 1
+        return self.data
+
+    def release(self):
+        with self._lock:
+            self._users -= 1
+            if self._users <= 0:
+                self.close()
+
+    def close(self):
+        if not self.data.closed:
+            self.data.close()
+
+
+class DBMappedColumn(object):
+    """Column of a table snapshot, read from the memory mapped file
+
+    - used as a column list of DBTableModel; cells are decoded on access
+    - the first change copies the column into a list and unmaps it, the file
+      stays untouched
+    - close() unmaps a column that is no longer used
+    """
+
+    def __init__(self, mapped, blob_pos, offsets_pos, length):
+        self._mapped = mapped
+        self._data = mapped.acquire()
+        self._blob_pos = blob_pos
+        self._offsets_pos = offsets_pos
+        self._length = length
+        # list of the values once the column was changed
+        self._values = None
+
+    def is_mapped(self):
+        return self._values is None
+
+    def maps(self, path):
+        # True if the column still reads from the file path
+        return self._data is not None and self._mapped.path == os.path.abspath(path)
+
+    def detached(self):
+        # unchanging copy reading from the same map, e.g. for a worker thread
+        # while this column may be changed; close it when done
+        if self._data is None:
+            return list(self._values or [])
+        return DBMappedColumn(self._mapped, self._blob_pos, self._offsets_pos, self._length)
+
+    def close(self):
+        # release the map; a column that was not copied to a list is empty after
+        if self._data is None:
+            return
+        self._data = None
+        if self._values is None:
+            self._values = []
+        self._mapped.release()
+
+    def _offsets(self, first, count):
+        return struct.unpack_from('<{}Q'.format(count), self._data, self._offsets_pos + 8 * first)
+
+    def _decode(self, first, last):
+        # values of rows first..last-1
+        if first >= last:
+            return []
+        offsets = self._offsets(first, last - first + 1)
+        data, pos = self._data, self._blob_pos
+        return [json.loads(data[pos + start:pos + end])
+                for start, end in zip(offsets, offsets[1:])]
+
+    def __len__(self):
+        if self._values is not None:
+            return len(self._values)
+        return self._length
+
+    def __getitem__(self, index):
+        if self._values is not None:
+            return self._values[index]
+        if isinstance(index, slice):
+            first, last, step = index.indices(self._length)
+            if step != 1:
+                return self._decode(0, self._length)[index]
+            return self._decode(first, last)
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('column index out of range')
+        return self._decode(index, index + 1)[0]
+
+    def __iter__(self):
+        if self._values is not None:
+            return iter(self._values)
+        return self._iter_mapped()
+
+    def _iter_mapped(self, chunk_size=4096):
+        for first in range(0, self._length, chunk_size):
+            yield from self._decode(first, min(first + chunk_size, self._length))
+
+    def _materialize(self):
+        if self._values is None:
+            self._values = self._decode(0, self._length)
+        if self._data is not None:
+            self._data = None
+            self._mapped.release()
+        return self._values
+
+    def __setitem__(self, index, value):
+        self._materialize()[index] = value
+
+    def __delitem__(self, index):
+        if (self._values is None and isinstance(index, slice)
+                and index.indices(self._length) == (0, self._length, 1)):
+            # all rows, nothing to copy
+            self.close()
+            return
+        del self._materialize()[index]
+
+    def append(self, value):
+        self._materialize().append(value)
+
+    def extend(self, values):
+        self._materialize().extend(values)
+
+    def insert(self, index, value):
+        self._materialize().insert(index, value)
+
+
+# sorting and filtering #######################################################
+def _sort_key(value):
+    # numbers (also as text) before text, text ignoring case, empty cells last
+    if value is None or value == '':
+        return (2, 0, '')
+    if isinstance(value, (int, float)) and value == value:
+        return (0, value, '')
+    text = str(value)
+    try:
+        number = float(text)
+    except ValueError:
+        return (1, 0, text.lower())
+    if number != number:
+        # nan does not order
+        return (1, 0, text.lower())
+    return (0, number, '')
+
+
+class DBTableProxyModel(QtGui.QAbstractProxyModel):
+    """Sorted and filtered view of a DBTable model
+
+    - without sort or filter, rows map 1:1 to the source model
+    - sort keys are made once per column from the raw values (numbers sort as
+    numbers) and follow the source changes; the sorted order of every column
+    and direction is cached until the source changes
+    - the view order is a list of source rows; equal keys keep the source
+    order, so a row's place is found by binary search
+    - rows appended or a single row updated in the source are moved to their
+    place; larger batches rebuild the order as a layout change, which keeps
+    the selection
+    - filters are per column: a string matches cells containing it ignoring
+    case, a callable is called with the cell value
+    """
+
+    # above this many changed rows the order is rebuilt instead
+    BULK_ROWS = 100
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._source = None
+        self._sort_col = None
+        self._descending = False
+        self._filters = {}
+        # view row -> source row, None while rows map 1:1
+        self._rows = None
+        # one byte per source row, 1 for the rows in _rows
+        self._shown = None
+        # col -> sort key / lowercase text per source row
+        self._keys = {}
+        self._texts = {}
+        # (col, descending) -> sorted source rows
+        self._perms = {}
+        # source change forwarded as is, between its two signals
+        self._pending = None
+        # persistent indexes and their source rows across a source layout change
+        self._layout_sources = None
+
+    def setSourceModel(self, model):
+        self.beginResetModel()
+        super().setSourceModel(model)
+        self._source = model
+        model.rowsAboutToBeInserted.connect(self._source_rows_about_to_be_inserted)
+        model.rowsInserted.connect(self._source_rows_inserted)
+        model.rowsAboutToBeRemoved.connect(self._source_rows_about_to_be_removed)
+        model.rowsRemoved.connect(self._source_rows_removed)
+        model.dataChanged.connect(self._source_data_changed)
+        model.modelAboutToBeReset.connect(self._source_about_to_be_reset)
+        model.modelReset.connect(self._source_reset)
+        model.layoutAboutToBeChanged.connect(self._source_layout_about_to_change)
+        model.layoutChanged.connect(self._source_layout_changed)
+        model.columnsAboutToBeInserted.connect(
+            lambda parent, first, last: self.beginInsertColumns(QtCore.QModelIndex(), first, last))
+        model.columnsInserted.connect(lambda *args: self.endInsertColumns())
+        model.columnsAboutToBeRemoved.connect(
+            lambda parent, first, last: self.beginRemoveColumns(QtCore.QModelIndex(), first, last))
+        model.columnsRemoved.connect(lambda *args: self.endRemoveColumns())
+        model.headerDataChanged.connect(self.headerDataChanged)
+        self._clear_caches()
+        self._set_rows(self._build_rows())
+        self.endResetModel()
+
+    # model interface
+    def index(self, row, col, parent=QtCore.QModelIndex()):
+        if (parent.isValid() or row < 0 or col < 0
+                or row >= self.rowCount() or col >= self.columnCount()):
+            return QtCore.QModelIndex()
+        return self.createIndex(row, col)
+
+    def parent(self, index=None):
+        if index is None:
+            # QObject.parent
+            return super().parent()
+        return QtCore.QModelIndex()
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid() or self._source is None:
+            return 0
+        if self._rows is None:
+            return self._source.rowCount()
+        return len(self._rows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid() or self._source is None:
+            return 0
+        return self._source.columnCount()
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Horizontal:
+            return self._source.headerData(section, orientation, role)
+        if role == QtCore.Qt.DisplayRole:
+            return section + 1
+        return None
+
+    def mapToSource(self, index):
+        if not index.isValid():
+            return QtCore.QModelIndex()
+        return self._source.index(self.source_row(index.row()), index.column())
+
+    def mapFromSource(self, index):
+        if not index.isValid():
+            return QtCore.QModelIndex()
+        row = self.view_row(index.row())
+        if row == -1:
+            return QtCore.QModelIndex()
+        return self.index(row, index.column())
+
+    def source_row(self, row):
+        if self._rows is None:
+            return row
+        return self._rows[row]
+
+    def view_row(self, source_row):
+        # row of the view showing source_row, -1 if it is filtered out
+        if self._rows is None:
+            return source_row
+        if source_row >= len(self._shown) or not self._shown[source_row]:
+            return -1
+        pos = self._insert_position(source_row)
+        if pos < len(self._rows) and self._rows[pos] == source_row:
+            return pos
+        # the row is not at the place its key asks for (its value just changed)
+        return self._rows.index(source_row)
+
+    def _set_rows(self, rows):
+        self._rows = rows
+        if rows is None:
+            self._shown = None
+            return
+        self._shown = bytearray(self._source.rowCount())
+        for row in rows:
+            self._shown[row] = 1
+
+    # sorting and filtering
+    def sort(self, col, order=QtCore.Qt.AscendingOrder):
+        # col < 0 restores the source order
+        self._sort_col = col if col >= 0 else None
+        self._descending = order == QtCore.Qt.DescendingOrder
+        self._relayout()
+
+    def sort_column(self):
+        return self._sort_col
+
+    def order_bytes(self):
+        # size of the row order and the cached keys, texts and permutations
+        size = sys.getsizeof(self._rows) if self._rows is not None else 0
+        size += sys.getsizeof(self._shown) if self._shown is not None else 0
+        for cache in (self._keys, self._texts, self._perms):
+            size += sum(sys.getsizeof(values) for values in cache.values())
+        return size
+
+    def set_filter(self, col, value):
+        # value None or '' removes the filter of col
+        if value is None or value == '':
+            self._filters.pop(col, None)
+        else:
+            self._filters[col] = value.lower() if isinstance(value, str) else value
+        self.beginResetModel()
+        self._set_rows(self._build_rows())
+        self.endResetModel()
+
+    def clear_filters(self):
+        self._filters = {}
+        self.beginResetModel()
+        self._set_rows(self._build_rows())
+        self.endResetModel()
+
+    def filters(self):
+        return dict(self._filters)
+
+    def _column_keys(self, col):
+        if col not in self._keys:
+            self._keys[col] = [_sort_key(v) for v in self._source.column_values(col)]
+        return self._keys[col]
+
+    def _column_texts(self, col):
+        if col not in self._texts:
+            self._texts[col] = ['' if v is None else str(v).lower()
+                                for v in self._source.column_values(col)]
+        return self._texts[col]
+
+    def _accepts(self, row):
+        for col, value in self._filters.items():
+            if col >= self._source.columnCount():
+                return False
+            if callable(value):
+                if not value(self._source.cell_value(row, col)):
+                    return False
+            elif value not in self._column_texts(col)[row]:
+                return False
+        return True
+
+    def _permutation(self):
+        key = (self._sort_col, self._descending)
+        if key not in self._perms:
+            keys = self._column_keys(self._sort_col)
+            if self._descending:
+                # stable, equal keys stay in source order
+                self._perms[key] = sorted(range(len(keys)), key=keys.__getitem__, reverse=True)
+            else:
+                self._perms[key] = sorted(range(len(keys)), key=keys.__getitem__)
+        return self._perms[key]
+
+    def _build_rows(self):
+        if self._source is None:
+            return None
+        sorting = self._sort_col is not None and self._sort_col < self._source.columnCount()
+        if not sorting and not self._filters:
+            return None
+        if sorting:
+            rows = self._permutation()
+        else:
+            rows = range(self._source.rowCount())
+        if self._filters:
+            return [row for row in rows if self._accepts(row)]
+        return list(rows)
+
+    def _before(self, a, b):
+        # source row a comes before source row b in the view
+        if self._sort_col is None or self._sort_col >= self._source.columnCount():
+            return a < b
+        keys = self._column_keys(self._sort_col)
+        if keys[a] == keys[b]:
+            return a < b
+        return (keys[a] < keys[b]) != self._descending
+
+    def _insert_position(self, source_row):
+        lo, hi = 0, len(self._rows)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._before(self._rows[mid], source_row):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _clear_caches(self):
+        self._keys = {}
+        self._texts = {}
+        self._perms = {}
+
+    def _update_caches(self, first, last, cols=None, append=False):
+        # re-read rows first..last of the cached columns
+        self._perms = {}
+        for cache, convert in ((self._keys, _sort_key),
+                               (self._texts, lambda v: '' if v is None else str(v).lower())):
+            for col in list(cache):
+                if cols is not None and col not in cols:
+                    continue
+                values = [convert(v) for v in self._source.column_values(col, first, last)]
+                if append:
+                    cache[col].extend(values)
+                else:
+                    cache[col][first:last + 1] = values
+
+    def _rebuild(self):
+        self.beginResetModel()
+        self._set_rows(self._build_rows())
+        self.endResetModel()
+
+    def _relayout(self):
+        # new row order as a layout change, so selection and current index
+        # follow their rows; the source rows must not have been renumbered
+        self._end_layout(*self._begin_layout())
+
+    def _begin_layout(self):
+        # persistent indexes and their (source row, col)
+        self.layoutAboutToBeChanged.emit()
+        persistent = self.persistentIndexList()
+        return persistent, [(self.source_row(index.row()), index.column()) for index in persistent]
+
+    def _end_layout(self, persistent, sources):
+        # new row order; sources are the (source row, col) of persistent now,
+        # row -1 for rows that are gone
+        self._set_rows(self._build_rows())
+        self.changePersistentIndexList(
+            persistent, [self.index(self.view_row(row), col) if row >= 0 else QtCore.QModelIndex()
+                         for row, col in sources])
+        self.layoutChanged.emit()
+
+    # source changes
+    def _source_rows_about_to_be_inserted(self, parent, first, last):
+        if self._rows is None:
+            self.beginInsertRows(QtCore.QModelIndex(), first, last)
+            self._pending = 'insert'
+
+    def _source_rows_inserted(self, parent, first, last):
+        if last + 1 == self._source.rowCount():
+            self._update_caches(first, last, append=True)
+        else:
+            self._clear_caches()
+
+        if self._pending == 'insert':
+            self._pending = None
+            self.endInsertRows()
+            return
+
+        if last + 1 != self._source.rowCount():
+            # inserted in the middle, the rows after it were renumbered
+            self._rebuild()
+            return
+        if last - first >= self.BULK_ROWS:
+            self._relayout()
+            return
+        self._shown.extend(bytearray(last - first + 1))
+        for row in range(first, last + 1):
+            if self._accepts(row):
+                pos = self._insert_position(row)
+                self.beginInsertRows(QtCore.QModelIndex(), pos, pos)
+                self._rows.insert(pos, row)
+                self._shown[row] = 1
+                self.endInsertRows()
+
+    def _source_rows_about_to_be_removed(self, parent, first, last):
+        if self._rows is None:
+            self.beginRemoveRows(QtCore.QModelIndex(), first, last)
+            self._pending = 'remove'
+            return
+
+        view_rows = [self.view_row(row) for row in range(first, last + 1)]
+        ranges = _row_ranges(row for row in view_rows if row != -1)
+        if len(ranges) > self.BULK_ROWS:
+            self._layout_sources = self._begin_layout()
+            self._pending = 'layout'
+            return
+        for view_first, view_last in reversed(ranges):
+            self.beginRemoveRows(QtCore.QModelIndex(), view_first, view_last)
+            del self._rows[view_first:view_last + 1]
+            self.endRemoveRows()
+
+    def _source_rows_removed(self, parent, first, last):
+        for cache in (self._keys, self._texts):
+            for values in cache.values():
+                del values[first:last + 1]
+        self._perms = {}
+        if self._shown is not None:
+            del self._shown[first:last + 1]
+
+        pending, self._pending = self._pending, None
+        if pending == 'remove':
+            self.endRemoveRows()
+            return
+        count = last - first + 1
+        if pending == 'layout':
+            persistent, sources = self._layout_sources
+            self._layout_sources = None
+            self._end_layout(persistent, [(-1 if first <= row <= last else
+                                           row - count if row > last else row, col)
+                                          for row, col in sources])
+            return
+        # rows after the removed ones moved up
+        self._rows = [row - count if row > last else row for row in self._rows]
+
+    def _source_data_changed(self, top_left, bottom_right):
+        if getattr(self._source, 'updating_states', False):
+            # only colours changed, keys and order stay
+            self._forward_data_changed(top_left, bottom_right)
+            return
+        if not top_left.isValid() or not bottom_right.isValid():
+            self._clear_caches()
+            if self._rows is not None:
+                self._relayout()
+            return
+
+        first, last = top_left.row(), bottom_right.row()
+        cols = range(top_left.column(), bottom_right.column() + 1)
+        self._update_caches(first, last, cols)
+
+        if self._rows is not None:
+            moves = self._sort_col in cols or any(col in cols for col in self._filters)
+            if moves and last > first:
+                # several rows out of place at once, the binary search needs
+                # all others in order
+                self._relayout()
+                return
+            if moves:
+                self._reposition(first)
+            view_rows = [self.view_row(row) for row in range(first, last + 1)]
+            ranges = _row_ranges(row for row in view_rows if row != -1)
+        else:
+            ranges = [(first, last)]
+
+        for view_first, view_last in ranges:
+            self.dataChanged.emit(self.index(view_first, cols[0]), self.index(view_last, cols[-1]))
+
+    def _forward_data_changed(self, top_left, bottom_right):
+        # dataChanged of the view rows showing the source rows
+        if not top_left.isValid() or not bottom_right.isValid():
+            return
+        first, last = top_left.row(), bottom_right.row()
+        if self._rows is None:
+            ranges = [(first, last)]
+        elif last - first >= self.BULK_ROWS:
+            # rows spread over the view, one span covers them
+            ranges = [(0, len(self._rows) - 1)] if self._rows else []
+        else:
+            view_rows = (self.view_row(row) for row in range(first, last + 1))
+            ranges = _notify_ranges(row for row in view_rows if row != -1)
+        for view_first, view_last in ranges:
+            self.dataChanged.emit(self.index(view_first, top_left.column()),
+                                  self.index(view_last, bottom_right.column()))
+
+    def _reposition(self, source_row):
+        # move, show or hide one changed row
+        pos = self.view_row(source_row)
+        if not self._accepts(source_row):
+            if pos != -1:
+                self.beginRemoveRows(QtCore.QModelIndex(), pos, pos)
+                del self._rows[pos]
+                self._shown[source_row] = 0
+                self.endRemoveRows()
+            return
+        if pos == -1:
+            new = self._insert_position(source_row)
+            self.beginInsertRows(QtCore.QModelIndex(), new, new)
+            self._rows.insert(new, source_row)
+            self._shown[source_row] = 1
+            self.endInsertRows()
+            return
+
+        del self._rows[pos]
+        new = self._insert_position(source_row)
+        self._rows.insert(pos, source_row)
+        if new == pos:
+            return
+        # moving down, the destination is counted before the row is taken out
+        self.beginMoveRows(QtCore.QModelIndex(), pos, pos, QtCore.QModelIndex(),
+                           new if new < pos else new + 1)
+        del self._rows[pos]
+        self._rows.insert(new, source_row)
+        self.endMoveRows()
+
+    def _source_about_to_be_reset(self):
+        self.beginResetModel()
+
+    def _source_layout_about_to_change(self):
+        # source rows are moved or removed in one go; the selection follows
+        # them through persistent indexes of the source
+        persistent, sources = self._begin_layout()
+        self._layout_sources = (persistent, [QtCore.QPersistentModelIndex(self._source.index(row, col))
+                                             for row, col in sources])
+
+    def _source_layout_changed(self):
+        persistent, sources = self._layout_sources
+        self._layout_sources = None
+        self._clear_caches()
+        self._end_layout(persistent, [(index.row() if index.isValid() else -1, index.column())
+                                      for index in sources])
+
+    def _source_reset(self):
+        self._clear_caches()
+        self._set_rows(self._build_rows())
+        self.endResetModel()
+
+
+# list models #################################################################
+class DBListModel(QtCore.QAbstractListModel):
+    """Item model of DBComboBox with a search index
+
+    - items are kept in a plain list, one model reset per replace
+    - lowercase text of all items is joined into one string, so a substring
+    search is a single str.find; sorted lowercase keys serve prefix searches
+    - match() uses the index, which makes findText and the keyboard search of
+    the combobox fast on large lists
+    - each item can carry a record (e.g. ORM row), returned for Qt.UserRole;
+    records are kept as given, a leading '' item without a record is allowed
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._items = []
+        self._records = []
+        # rows before the first record (the leading '' item)
+        self._record_offset = 0
+        self._clear_index()
+
+    def _clear_index(self):
+        self._lower = None
+        self._joined = ''
+        self._starts = array('q')
+        self._exact = None
+        self._sorted_keys = None
+        self._sorted_rows = None
+        self._last_filter = None
+
+    def _build_index(self):
+        # substring index; built on the first search after a change
+        self._lower = [item.lower() for item in self._items]
+        self._joined = '\n'.join(self._lower)
+        self._starts = array('q', itertools.accumulate(
+            itertools.chain([0], (len(txt) + 1 for txt in self._lower[:-1]))))
+
+    def _build_sorted_index(self):
+        # prefix and exact text indexes; built on the first search that needs them
+        if self._lower is None:
+            self._build_index()
+        self._exact = {}
+        for row, item in enumerate(self._items):
+            self._exact.setdefault(item, []).append(row)
+        order = sorted(range(len(self._lower)), key=self._lower.__getitem__)
+        self._sorted_keys = [self._lower[row] for row in order]
+        self._sorted_rows = order
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._items)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role in (QtCore.Qt.DisplayRole, QtCore.Qt.EditRole):
+            return self._items[index.row()]
+        if role == QtCore.Qt.UserRole:
+            return self.record(index.row())
+        return None
+
+    def items(self):
+        return self._items
+
+    def records(self):
+        return self._records
+
+    def set_items(self, items, records=None):
+        # replace items and records together; records is one per item, one per
+        # item after a leading '' item, or empty. Other counts are logged and
+        # the items without a record get None
+        items = [str(item) for item in items]
+        records = list(records) if records else []
+        offset = 0
+        if records and len(records) != len(items):
+            if items and items[0] == '' and len(records) == len(items) - 1:
+                offset = 1
+            else:
+                logger.warning('%s records for %s items, records matched from the first item',
+                               len(records), len(items))
+
+        self.beginResetModel()
+        self._items = items
+        self._records = records
+        self._record_offset = offset
+        self._clear_index()
+        self.endResetModel()
+
+    def record(self, row):
+        # record of the item in row, None for items without one
+        row -= self._record_offset
+        if 0 <= row < len(self._records):
+            return self._records[row]
+        return None
+
+    def row_for_text(self, txt):
+        # first row showing exactly txt, -1 if none
+        if self._exact is None:
+            self._build_sorted_index()
+        rows = self._exact.get(txt)
+        return rows[0] if rows else -1
+
+    def find(self, txt):
+        # first row whose text contains txt, ignoring case; -1 if none
+        if self._lower is None:
+            self._build_index()
+        if not self._items or '\n' in txt:
+            return -1
+        pos = self._joined.find(txt.lower())
+        if pos == -1:
+            return -1
+        return bisect.bisect_right(self._starts, pos) - 1
+
+    def find_prefix(self, txt):
+        # rows whose text starts with txt, ignoring case, in item order
+        if self._sorted_keys is None:
+            self._build_sorted_index()
+        txt = txt.lower()
+        first = bisect.bisect_left(self._sorted_keys, txt)
+        last = bisect.bisect_left(self._sorted_keys, txt + '\U0010ffff', first)
+        return sorted(self._sorted_rows[first:last])
+
+    def filter(self, txt):
+        # rows whose text contains txt, ignoring case, in item order
+        # typing one more character only searches the previous matches
+        if self._lower is None:
+            self._build_index()
+        txt = txt.lower()
+        if self._last_filter and self._last_filter[0] and txt.startswith(self._last_filter[0]):
+            rows = [row for row in self._last_filter[1] if txt in self._lower[row]]
+        elif not txt:
+            rows = list(range(len(self._items)))
+        else:
+            rows = []
+            pos = self._joined.find(txt) if '\n' not in txt else -1
+            while pos != -1:
+                row = bisect.bisect_right(self._starts, pos) - 1
+                rows.append(row)
+                # continue after this item
+                pos = self._joined.find(txt, self._starts[row] + len(self._lower[row]) + 1)
+        self._last_filter = (txt, rows)
+        return rows
+
+    def match(self, start, role, value, hits=1, flags=QtCore.Qt.MatchStartsWith | QtCore.Qt.MatchWrap):
+        # indexed version of QAbstractItemModel.match for single hits on the text
+        flags = int(flags)
+        match_type = flags & 0x0F
+        case_sensitive = bool(flags & QtCore.Qt.MatchCaseSensitive)
+        if (role not in (QtCore.Qt.DisplayRole, QtCore.Qt.EditRole) or hits != 1
+                or not isinstance(value, str) or flags & QtCore.Qt.MatchRecursive):
+            return super().match(start, role, value, hits, flags)
+
+        if match_type == QtCore.Qt.MatchExactly or (match_type == QtCore.Qt.MatchFixedString
+                                                    and case_sensitive):
+            if self._exact is None:
+                self._build_sorted_index()
+            rows = self._exact.get(value, [])
+        elif match_type == QtCore.Qt.MatchFixedString:
+            rows = [row for row in self.find_prefix(value) if self._lower[row] == value.lower()]
+        elif match_type == QtCore.Qt.MatchStartsWith:
+            rows = self.find_prefix(value)
+            if case_sensitive:
+                rows = [row for row in rows if self._items[row].startswith(value)]
+        elif match_type == QtCore.Qt.MatchContains and not case_sensitive:
+            rows = self.filter(value)
+        else:
+            return super().match(start, role, value, hits, flags)
+
+        # first hit from the start row, wrapping around if asked to
+        start_row = max(start.row(), 0)
+        pos = bisect.bisect_left(rows, start_row)
+        if pos < len(rows):
+            return [self.index(rows[pos], 0)]
+        if rows and flags & QtCore.Qt.MatchWrap:
+            return [self.index(rows[0], 0)]
+        return []
+
+
+# reference data cache ########################################################
+class DBReferenceCache(QtCore.QObject):
+    """Shared reference lists (locations, part types, operators, ...) of DBComboBox
+
+    - entries are keyed by query or source name; each holds one DBListModel
+    that all comboboxes bound to the key show, so the strings are kept once
+    - loaders return the items or (items, records), same as a combobox query
+    - an entry older than its ttl_s is reloaded on the next use; with
+    background=True the old items stay shown until the new ones arrive
+    - at most max_entries are kept, the least recently used are dropped first;
+    comboboxes still showing a dropped model keep it
+    - invalidate() marks entries for reloading, refresh() reloads right away
+    """
+
+    entryLoaded = QtCore.pyqtSignal(object)
+
+    def __init__(self, max_entries=64, ttl_s=600.0, parent=None):
+        super().__init__(parent)
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def register(self, key, loader, ttl_s=None):
+        # set the loader of key; nothing is loaded until the model is used
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = {'model': DBListModel(), 'loaded_at': None,
+                                          'loading': False, 'ttl_s': self.ttl_s}
+            self._evict()
+        entry['loader'] = loader
+        if ttl_s is not None:
+            entry['ttl_s'] = ttl_s
+        return entry['model']
+
+    def model(self, key, loader=None, background=False):
+        # the shared model of key, (re)loaded when it is missing or expired
+        if loader is not None:
+            self.register(key, loader)
+        elif key not in self._entries:
+            raise KeyError('no loader registered for {!r}'.format(key))
+        self._entries.move_to_end(key)
+
+        entry = self._entries[key]
+        if self.is_stale(key):
+            self.misses += 1
+            self.refresh(key, background)
+        else:
+            self.hits += 1
+        return entry['model']
+
+    def is_stale(self, key):
+        entry = self._entries[key]
+        return entry['loaded_at'] is None or monotonic() - entry['loaded_at'] > entry['ttl_s']
+
+    def refresh(self, key, background=False):
+        # reload key now; the shared model updates all bound comboboxes
+        # returns False for a key that was dropped (evicted, removed or
+        # cleared): its loader is gone, comboboxes showing it keep the items
+        entry = self._entries.get(key)
+        if entry is None:
+            return False
+        if not background:
+            self._loaded(key, entry['loader']())
+        elif not entry['loading']:
+            entry['loading'] = True
+            query_runner().run(entry['loader'],
+                               on_result=lambda result, key=key: self._loaded(key, result),
+                               on_error=lambda error, key=key: self._load_failed(key, error))
+        return True
+
+    def seed(self, key, items, records=None):
+        # fill a registered entry that was not loaded yet, e.g. from a session
+        # snapshot; returns False when key has no loader or is loaded already
+        entry = self._entries.get(key)
+        if entry is None or entry['loaded_at'] is not None:
+            return False
+        entry['model'].set_items(items, records)
+        entry['loaded_at'] = monotonic()
+        return True
+
+    def invalidate(self, key=None):
+        # reload key (all keys when None) on its next use
+        if key is None:
+            entries = self._entries.values()
+        else:
+            entries = [self._entries[key]] if key in self._entries else []
+        for entry in entries:
+            entry['loaded_at'] = None
+
+    def remove(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries = OrderedDict()
+
+    def keys(self):
+        return list(self._entries)
+
+    def stats(self):
+        return {'entries': len(self._entries),
+                'items': sum(entry['model'].rowCount() for entry in self._entries.values()),
+                'hits': self.hits, 'misses': self.misses}
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _loaded(self, key, result):
+        entry = self._entries.get(key)
+        if entry is None:
+            # dropped while loading
+            return
+        entry['loading'] = False
+        items, records = result if isinstance(result, tuple) else (result, [])
+        entry['model'].set_items(items, records)
+        entry['loaded_at'] = monotonic()
+        self.entryLoaded.emit(key)
+
+    def _load_failed(self, key, error):
+        if key in self._entries:
+            self._entries[key]['loading'] = False
+        logger.error('reference list %r failed to load: %s', key, error)
+
+
+reference_cache = DBReferenceCache()
+
+
 # groupbox contained input widgets #############################################
 class DBComboBox(DBWidget):
     """Combobox to show list of items from the database column
@@ -178,9 +2498,19 @@ class DBComboBox(DBWidget):
     - items is the list of (modified, if needed) strings to show to the user
     - raw_items is is the ORM query result as a list of records.
     This is used to get connected information with the shown item.
+    - items are held in a DBListModel, so searches use its index
+    - each item keeps its record; current_record and record_for look it up
+    without searching raw_items
+    - currentTextChanged is coalesced, by default to the last change of an event
+    loop turn (set_text_signal_mode); add_items emits it once when done
+    - bind_reference shows a shared list of the reference_cache instead of own
+    items; add_items and reset go back to own items
 
     """
 
+    # lists longer than this do not size the combobox to their widest item
+    LARGE_LIST = 1000
+
     currentTextChanged = QtCore.pyqtSignal(str)
     itemsAdded = QtCore.pyqtSignal()
 
@@ -188,9 +2518,10 @@ class DBComboBox(DBWidget):
         super().__init__(parent)
         self.name = name
         self.setObjectName(self.name)
+        # key of the bound reference list, None for own items
+        self.reference_key = None
+        self._reference_text = None
 
-        self.items = []
-        self.raw_items = []
         self.init_combobox()
 
     def init_combobox(self):
@@ -204,10 +2535,31 @@ class DBComboBox(DBWidget):
         self.input_values.lineEdit().setReadOnly(True)
         self.input_values.setEditable(False)
         self.input_values.setSizePolicy(sizePolicy)
-        self.input_values.currentIndexChanged.connect(self._currentIndexChanged)
+
+        # popup list does not measure every item of long lists
+        # the own model is not parented to the QComboBox, which deletes the
+        # models it owns when a shared one is set
+        self._own_model = DBListModel(self)
+        self.item_model = self._own_model
+        list_view = QtGui.QListView(self.input_values)
+        list_view.setUniformItemSizes(True)
+        self.input_values.setView(list_view)
+        self.input_values.setModel(self.item_model)
+        self.text_coalescer = DBSignalCoalescer('latest', 0, parent=self)
+        self.text_coalescer.triggered.connect(functools.partial(self._emit, 'currentTextChanged'))
+        self.connect_input_signals()
 
         self.add_item_to_box(self.input_values)
 
+    def connect_input_signals(self):
+        self.input_values.currentIndexChanged.connect(self._currentIndexChanged)
+
+    def input_settings(self):
+        # setReadOnly of the combobox sets whether it is editable
+        settings = super().input_settings()
+        settings['read_only'] = self.input_values.isEditable()
+        return settings
+
     def set_focus_policy(self, policy_txt):
         # sets default focus to the widget, if enabled in settings
         if policy_txt.lower() == 'no':
@@ -219,36 +2571,163 @@ class DBComboBox(DBWidget):
         elif policy_txt.lower() == 'tab':
             self.input_values.setFocusPolicy(QtCore.Qt.ClickFocus)
 
+    @instrumented('population')
     def add_items(self, items, raw_items, font_size=12):
         # items are list of items (strings to display)
         # raw_items are database response with all the relevant data
-        self.input_values.clear()
-        self.items = items
-        if raw_items:
-            self.raw_items = raw_items
-        self.input_values.addItems(items)
-        self.itemsAdded.emit()
+        # raw_items has one record per item, or is empty when items have no records
+        self.unbind_reference()
+        if len(items) > self.LARGE_LIST:
+            self.input_values.setSizeAdjustPolicy(QtGui.QComboBox.AdjustToMinimumContentsLength)
+        # index changes while refilling are not passed on, only the final text
+        with self.text_coalescer.suppressed():
+            self.item_model.set_items(items, raw_items)
+            if items:
+                self.input_values.setCurrentIndex(0)
+        self.text_coalescer.push(self.input_values.currentText())
+        self._emit('itemsAdded')
         self.input_values = self.increase_font(self.input_values, font_size)
         # self.input_values.resize(self.input_values.sizeHint())
 
+    def bind_reference(self, key, loader=None, cache=None, background=False, font_size=12):
+        # show the shared reference list key of cache (default reference_cache);
+        # loader registers or replaces the loader of key
+        cache = reference_cache if cache is None else cache
+        model = cache.model(key, loader, background)
+        self._set_item_model(model)
+        self.reference_key = key
+        if model.rowCount() > self.LARGE_LIST:
+            self.input_values.setSizeAdjustPolicy(QtGui.QComboBox.AdjustToMinimumContentsLength)
+        self.input_values = self.increase_font(self.input_values, font_size)
+
+    def unbind_reference(self):
+        # back to own items (empty until add_items)
+        if self.reference_key is None:
+            return
+        self._set_item_model(self._own_model)
+        self.reference_key = None
+
+    def _set_item_model(self, model):
+        if self.item_model is not self._own_model:
+            self.item_model.modelAboutToBeReset.disconnect(self._keep_reference_text)
+            self.item_model.modelReset.disconnect(self._restore_reference_text)
+        with self.text_coalescer.suppressed():
+            self.input_values.setModel(model)
+            self.item_model = model
+            if model.rowCount():
+                self.input_values.setCurrentIndex(0)
+        if model is not self._own_model:
+            # a reload of the shared list keeps the selected item
+            model.modelAboutToBeReset.connect(self._keep_reference_text)
+            model.modelReset.connect(self._restore_reference_text)
+        self.text_coalescer.push(self.input_values.currentText())
+
+    def get_state(self):
+        records = self.raw_items
+        return {'items': list(self.items),
+                'records': list(records) if any(record is not None for record in records) else [],
+                'text': self.input_values.currentText(),
+                'reference': self.reference_key}
+
+    def restore_state(self, state):
+        # a shared list is bound again; its cache entry is filled from the
+        # state if it was not loaded yet
+        key = state['reference']
+        if key is not None and key in reference_cache.keys():
+            reference_cache.seed(key, state['items'], state['records'])
+            self.bind_reference(key)
+        else:
+            self.add_items(state['items'], state['records'] or [])
+        row = self.item_model.row_for_text(state['text'])
+        if row != -1:
+            self.input_values.setCurrentIndex(row)
+
+    def resync(self):
+        if self.reference_key is not None:
+            reference_cache.refresh(self.reference_key, background=True)
+        else:
+            super().resync()
+
+    def memory_usage(self):
+        usage = super().memory_usage()
+        usage['cells'] = usage['rows']
+        # a shared list is counted once, in reference_cache
+        usage['shared'] = self.reference_key is not None
+        return usage
+
+    def _keep_reference_text(self):
+        self._reference_text = self.input_values.currentText()
+
+    def _restore_reference_text(self):
+        row = self.item_model.row_for_text(self._reference_text)
+        if row == -1 and self.item_model.rowCount():
+            row = 0
+        self.input_values.setCurrentIndex(row)
+
+    @property
+    def items(self):
+        # strings shown to the user
+        return self.item_model.items()
+
+    @items.setter
+    def items(self, items):
+        # shows items with the current records, same as add_items without the
+        # font and signals
+        self.unbind_reference()
+        self.item_model.set_items(items, self.raw_items)
+
+    @property
+    def raw_items(self):
+        # records as given to add_items, empty for items without records
+        return self.item_model.records()
+
+    @raw_items.setter
+    def raw_items(self, raw_items):
+        self.unbind_reference()
+        self.item_model.set_items(self.items, raw_items)
+
+    def current_record(self):
+        # record of the selected item
+        return self.item_model.record(self.input_values.currentIndex())
+
+    def record_for(self, txt):
+        # record of the item showing exactly txt, None if there is no such item
+        return self.item_model.record(self.item_model.row_for_text(txt))
+
     def setReadOnly(self, state=False):
         # Make the input field read only
         self.input_values.setEditable(state)
 
+    def apply_query_result(self, result):
+        # result is (items, raw_items) or only the list of items
+        if isinstance(result, tuple):
+            self.add_items(*result)
+        else:
+            self.add_items(result, [])
+
+    @instrumented('search')
     def set_text(self, txt):
         # set txt programmatically
-        full_input_txt = [item_txt for item_txt in self.items if txt.lower() in item_txt.lower()]
-        if len(full_input_txt) > 0:
-            txt_index = self.input_values.findText(full_input_txt[0])
-            if txt_index != -1:
-                self.input_values.setCurrentIndex(txt_index)
-                return True
+        # selects the first item containing txt, ignoring case
+        txt_index = self.item_model.find(txt)
+        if txt_index != -1:
+            self.input_values.setCurrentIndex(txt_index)
+            return True
 
         return False
 
+    def filter_items(self, txt):
+        # type-ahead: indexes of the items containing txt, ignoring case
+        return self.item_model.filter(txt)
+
+
+    def set_text_signal_mode(self, mode='latest', interval_ms=0):
+        # how currentTextChanged is coalesced, e.g. ('debounce', 300) for
+        # lookups while the user scrolls through the list
+        self.text_coalescer.configure(mode, interval_ms)
 
     def _currentIndexChanged(self):
-        self.currentTextChanged.emit(self.input_values.currentText())
+        self.text_coalescer.push(self.input_values.currentText())
 
     def current_value(self):
         # get current value of text
@@ -259,9 +2738,13 @@ class DBComboBox(DBWidget):
         # can be used when "" is in the items as first item
         self.input_values.setCurrentIndex(0)
 
-    def clear_text_and_set_focus(self):
-        self.input_values.setCurrentIndex(0)
-        self.input_values.setFocus()
+    def reset(self):
+        # no items or records are kept for the next session; a shared list is
+        # left alone
+        super().reset()
+        self.unbind_reference()
+        self.item_model.set_items([])
+        self.text_coalescer.cancel()
 
 
 class DBLineEdit(DBWidget):
@@ -309,16 +2792,22 @@ class DBLineEdit(DBWidget):
         # get current value of text
         return self.input_values.text()
 
+    @instrumented('population')
     def set_text(self, msg, font_size=11):
         self.input_values = self.increase_font(self.input_values, font_size)
         self.input_values.setText(msg)
 
+    def apply_query_result(self, result):
+        self.set_text(str(result))
+
     def clear_text(self):
         self.input_values.clear()
 
-    def clear_text_and_set_focus(self):
-        self.input_values.clear()
-        self.input_values.setFocus()
+    def get_state(self):
+        return {'text': self.input_values.text()}
+
+    def restore_state(self, state):
+        self.input_values.setText(state['text'])
 
 
 class DBTextEdit(DBWidget):
@@ -327,6 +2816,8 @@ class DBTextEdit(DBWidget):
     - items is the string to show to the user
     - can be set as readonly
     - used for multiline text
+    - set_log_mode makes it a running log: append_log adds lines at the end once
+    per frame and only the last max_lines are kept; reset leaves log mode
 
     """
 
@@ -334,6 +2825,9 @@ class DBTextEdit(DBWidget):
         super().__init__(parent)
         self.name = name
         self.setObjectName(self.name)
+        # lines waiting for the next frame, None when not in log mode
+        self._log_pending = None
+        self._log_flush = None
 
         self.init_text()
 
@@ -363,22 +2857,89 @@ class DBTextEdit(DBWidget):
         # get current value of text
         return self.input_values.toPlainText()
 
+    @instrumented('population')
     def set_text(self, msg, font_size=11):
         self.input_values = self.increase_font(self.input_values, font_size)
         self.input_values.setText(msg)
 
+    def apply_query_result(self, result):
+        self.set_text(str(result))
+
+    def set_log_mode(self, max_lines=1000, font_size=11):
+        # plain text log of at most max_lines lines; the font is set here only
+        self.input_values = self.increase_font(self.input_values, font_size)
+        self.input_values.setAcceptRichText(False)
+        self.input_values.setUndoRedoEnabled(False)
+        self.input_values.document().setMaximumBlockCount(max_lines)
+        self._log_pending = deque(self._log_pending or (), maxlen=max_lines)
+        if self._log_flush is None:
+            self._log_flush = DBSignalCoalescer('latest', FRAME_MS, parent=self)
+            self._log_flush.triggered.connect(self.flush_log)
+
+    def append_log(self, msg):
+        # add msg as a line; lines of a frame are inserted together
+        if self._log_pending is None:
+            raise RuntimeError('{}: not in log mode'.format(self.name))
+        self._log_pending.append(str(msg))
+        self._log_flush.push(None)
+
+    def clear_log(self):
+        self.clear_text()
+
+    def leave_log_mode(self):
+        # back to a plain text edit, the text stays
+        if self._log_pending is None:
+            return
+        self.flush_log()
+        self._log_flush.cancel()
+        self._log_pending = None
+        self.input_values.document().setMaximumBlockCount(0)
+        self.input_values.setAcceptRichText(True)
+        self.input_values.setUndoRedoEnabled(True)
+
+    def reset(self):
+        # log mode belongs to the form that set it
+        super().reset()
+        self.leave_log_mode()
+
+    def flush_log(self, *args):
+        if not self._log_pending:
+            return
+        scroll_bar = self.input_values.verticalScrollBar()
+        at_end = scroll_bar.value() == scroll_bar.maximum()
+
+        text = '\n'.join(self._log_pending)
+        self._log_pending.clear()
+        cursor = QtGui.QTextCursor(self.input_values.document())
+        cursor.movePosition(QtGui.QTextCursor.End)
+        if not self.input_values.document().isEmpty():
+            text = '\n' + text
+        cursor.insertText(text)
+
+        # follow the log unless the user scrolled up
+        if at_end:
+            scroll_bar.setValue(scroll_bar.maximum())
+
     def clear_text(self):
+        if self._log_pending is not None:
+            self._log_pending.clear()
         self.input_values.setText('')
 
-    def clear_text_and_set_focus(self):
-        self.input_values.clear()
-        self.input_values.setFocus()
+    def get_state(self):
+        self.flush_log()
+        return {'text': self.input_values.toPlainText()}
+
+    def restore_state(self, state):
+        self.input_values.setPlainText(state['text'])
 
 
 class DBLabel(DBWidget):
     """Label to show readonly text from the database column
 
     - items is the string to show to the user
+    - set_log_mode makes it a status log of the last max_lines messages; the
+    text is set once per frame. update_text appends in log mode, only
+    clear_log empties it; reset leaves log mode
 
     """
 
@@ -386,6 +2947,9 @@ class DBLabel(DBWidget):
         super().__init__(parent)
         self.name = name
         self.setObjectName(self.name)
+        # shown lines in log mode, None otherwise
+        self._log = None
+        self._log_flush = None
 
         self.init_label()
 
@@ -414,7 +2978,12 @@ class DBLabel(DBWidget):
     def set_center_alignment(self):
         self.input_values.setAlignment(QtCore.Qt.AlignHCenter)
 
+    @instrumented('population')
     def update_text(self, msg, font_size=11, clear=True):
+        # in log mode msg is a new line and clear is ignored, see append_log
+        if self._log is not None:
+            self.append_log(msg)
+            return
         if clear:
             self.input_values.setText('')
         msg = self.input_values.text() + msg
@@ -422,30 +2991,136 @@ class DBLabel(DBWidget):
         self.input_values = self.increase_font(self.input_values, font_size)
         self.input_values.setWordWrap(True)
 
+    def apply_query_result(self, result):
+        self.update_text(str(result))
+
+    def set_log_mode(self, max_lines=50, font_size=11):
+        # keep the last max_lines messages as lines; font and word wrap are
+        # set here only
+        self.input_values = self.increase_font(self.input_values, font_size)
+        self.input_values.setWordWrap(True)
+        self._log = deque(self._log or (), maxlen=max_lines)
+        if self._log_flush is None:
+            self._log_flush = DBSignalCoalescer('latest', FRAME_MS, parent=self)
+            self._log_flush.triggered.connect(self.flush_log)
+
+    def append_log(self, msg):
+        if self._log is None:
+            raise RuntimeError('{}: not in log mode'.format(self.name))
+        self._log.append(str(msg))
+        self._log_flush.push(None)
+
+    def flush_log(self, *args):
+        if self._log is not None:
+            self.input_values.setText('\n'.join(self._log))
+
+    def clear_log(self):
+        self.clear_text()
+
+    def leave_log_mode(self):
+        # back to update_text replacing the text, the shown text stays
+        if self._log is None:
+            return
+        self.flush_log()
+        self._log_flush.cancel()
+        self._log = None
+
+    def reset(self):
+        # log mode belongs to the form that set it
+        super().reset()
+        self.leave_log_mode()
+
     def clear_text(self):
+        if self._log is not None:
+            self._log.clear()
         self.input_values.setText('')
 
-    def clear_text_and_set_focus(self):
-        self.input_values.setText('')
-        self.input_values.setFocus()
+    def get_state(self):
+        return {'text': self.input_values.text(),
+                'log': list(self._log) if self._log is not None else None}
+
+    def restore_state(self, state):
+        if self._log is not None and state['log'] is not None:
+            self._log.clear()
+            self._log.extend(state['log'])
+            self.flush_log()
+        else:
+            self.input_values.setText(state['text'])
 
 
 class DBTable(DBWidget):
     """Table widget
 
     - used to list of data
-    - right click menu to delete rows from the model
+    - right click menu to delete the selected rows from the model; rows are
+    removed in contiguous ranges (remove_selected_rows, remove_rows_by_keys,
+    remove_rows_where)
+    - virtual=True uses DBTableModel (column storage) instead of one
+    QStandardItem per cell; meant for large result sets
+    - rows are keyed on key_col; adding a row with a known key updates it in place
+    - population, validation, resize and repaint are timed in metrics when enabled
+    - memory_usage reports rows, cells and the size of the row bookkeeping
+    - get_state / restore_state keep rows, validity, row states and selection
+    for DBSession
+    - sort_by_column / set_filter work on a DBTableProxyModel between model and
+    view; row numbers of the DBTable methods (valid_rows, row_for_key, ...)
+    are model rows, view_row / model_row convert
+    - load_table_data streams rows from an iterator or DB-API cursor in
+    time slices, without blocking the event loop
+    - refresh applies a new result as a keyed diff (inserts, updates, removals);
+    with diff_refresh=True apply_query_result refreshes instead of replacing
+    - export_csv / export_snapshot write rows in a worker thread; load_snapshot
+    reads a snapshot back, with virtual=True straight from the mapped file
     """
 
-    def __init__(self, parent=None, name='dbtable'):
+    loadProgress = QtCore.pyqtSignal(int)
+    loadFinished = QtCore.pyqtSignal(int)
+    loadFailed = QtCore.pyqtSignal(str)
+    exportFinished = QtCore.pyqtSignal(str, int)
+    exportFailed = QtCore.pyqtSignal(object)
+
+    def __init__(self, parent=None, name='dbtable', virtual=False, key_col=0):
         super().__init__(parent)
         self.name = name
         self.setObjectName(self.name)
 
         self.raw_data = {}
-        self.valid_rows = []
+        # one byte per row, 1 for rows that passed check_valid_data
+        self.valid_mask = bytearray()
         self.data_validity = True
-        self.data_model = QtGui.QStandardItemModel()
+        # col -> array of the column parsed as int, kept in step with the model
+        self._typed_columns = {}
+        self._updating_states = False
+        self._removing_rows = False
+        # valid rows kept across a layout change of the model (e.g. item sort)
+        self._valid_persistent = []
+        # apply_query_result updates the rows with refresh instead of replacing them
+        self.diff_refresh = False
+        self.virtual = virtual
+        if self.virtual:
+            self.data_model = DBTableModel()
+        else:
+            self.data_model = DBStandardItemModel()
+
+        # key -> row, follows the model through its signals
+        self.key_col = key_col
+        self._default_key_col = key_col
+        self._key_index = {}
+        self.data_model.rowsInserted.connect(self._rows_inserted)
+        self.data_model.rowsRemoved.connect(self._rows_removed)
+        self.data_model.dataChanged.connect(self._data_changed)
+        self.data_model.layoutAboutToBeChanged.connect(self._layout_about_to_change)
+        self.data_model.layoutChanged.connect(self._layout_changed)
+        self.data_model.modelReset.connect(self._model_reset)
+
+        # streaming loader state
+        self._load_chunks = None
+        self._load_mode = 'append'
+        self._load_frame_ms = 15
+        self._loaded_rows = 0
+        self._load_timer = QtCore.QTimer(self)
+        self._load_timer.setInterval(0)
+        self._load_timer.timeout.connect(self._load_next_slice)
 
         self.init_table()
 
@@ -453,15 +3128,20 @@ class DBTable(DBWidget):
         # setup table
         sizePolicy = QtGui.QSizePolicy(QtGui.QSizePolicy.MinimumExpanding, QtGui.QSizePolicy.MinimumExpanding)
 
-        self.data_table = QtGui.QTableView(self)
+        # the view shows the model through the sort and filter proxy
+        self.proxy_model = DBTableProxyModel(self)
+        self.proxy_model.setSourceModel(self.data_model)
+
+        self.data_table = DBTableView(self)
         self.data_table.setAutoScroll(True)
-        self.data_table.setModel(self.data_model)
+        self.data_table.setModel(self.proxy_model)
         self.data_table.setSizePolicy(sizePolicy)
         self.data_table.setEditTriggers(QtGui.QAbstractItemView.NoEditTriggers)
         self.data_table.setSelectionMode(QtGui.QAbstractItemView.ExtendedSelection)
         self.data_table.setSelectionBehavior(QtGui.QAbstractItemView.SelectRows)
         self.data_table.setContextMenuPolicy(QtCore.Qt.CustomContextMenu)
-        self.data_table.customContextMenuRequested.connect(self.right_click_menu)
+        self.connect_input_signals()
+        self.remove_action = self.add_context_action('Remove selected rows', self.remove_selected_rows)
         # self.data_table.dataChanged.connect(self.result_table.resizeColumnsToContents)
 
         self.add_item_to_box(self.data_table)
@@ -486,9 +3166,23 @@ class DBTable(DBWidget):
         # clear data only for results model
         self.data_model.removeRows(0, self.data_model.rowCount())
 
-    def clear_text_and_set_focus(self):
-        self.data_model.removeRows(0, self.data_model.rowCount())
-        self.data_model.setFocus()
+    def focus_widget(self):
+        return self.data_table
+
+    def reset(self):
+        # rows, headers, hidden columns, validity, sorting, filters and the
+        # refresh settings are not kept for the next session
+        self.cancel_load()
+        super().reset()
+        for col in range(self.data_model.columnCount()):
+            self.data_table.showColumn(col)
+        self.proxy_model.clear_filters()
+        self.sort_by_column(-1)
+        self.reset_table()
+        self.raw_data = {}
+        self.data_validity = True
+        self.diff_refresh = False
+        self.set_key_column(self._default_key_col)
 
     def resize_widget_to_contents(self):
         self.resize(self.size().width(),
@@ -503,83 +3197,508 @@ class DBTable(DBWidget):
         # fill the widget
         self.data_table.horizontalHeader().setResizeMode(QtGui.QHeaderView.Stretch)
 
-    def set_table_data(self, table_data):
+    @instrumented('population')
+    def set_table_data(self, table_data, mode='upsert'):
         # add data to the table view
         # table_data is list(rows) of list(data)
         # table_data['headers'] : list
         # table_data['data'] : list
+        # mode 'replace' drops the current rows, 'append' adds all rows at the end
+        # and 'upsert' updates rows with a known key and appends the others
+        if mode not in ('replace', 'append', 'upsert'):
+            raise ValueError('unknown mode: {}'.format(mode))
+
         if 'header' in table_data:
             self.set_table_headers(table_data['header'])
 
-        if 'data' in table_data:
-            for row in table_data['data']:
-                self.add_single_row(row)
+        rows = table_data.get('data', [])
+        self.data_table.setUpdatesEnabled(False)
+        try:
+            if mode == 'replace':
+                self.data_model.replace_rows(rows)
+            elif mode == 'append':
+                self.data_model.append_rows(rows)
+            else:
+                self.upsert_rows(rows)
+        finally:
+            self.data_table.setUpdatesEnabled(True)
 
         self.resize_table_view()
 
+    def apply_query_result(self, result):
+        # result is a table_data dict or a list of rows; it replaces the rows
+        if not isinstance(result, dict):
+            result = {'data': list(result)}
+        if self.diff_refresh and self.data_model.rowCount():
+            if 'header' in result:
+                self.set_table_headers(result['header'])
+            self.refresh(result.get('data', []))
+        else:
+            self.set_table_data(result, mode='replace')
+
+    @instrumented('population')
+    def upsert_rows(self, rows):
+        # batch version of add_single_row; the last row wins on repeated keys
+        updates = {}
+        new_rows = {}
+        for row_list in rows:
+            key = self._make_key(row_list[self.key_col])
+            existing_row = self._key_index.get(key, -1)
+            if existing_row == -1:
+                new_rows[key] = row_list
+            else:
+                updates[existing_row] = row_list
+
+        self.data_model.set_rows(list(updates.items()))
+        self.data_model.append_rows(list(new_rows.values()))
+
+    @instrumented('population')
+    def refresh(self, new_rows, key_col=None):
+        # bring the table to new_rows with the fewest model changes: rows are
+        # matched on key_col and compared as shown text; changed rows are
+        # updated in place, missing rows removed and new rows appended.
+        # selection, row states and validity of the kept rows stay
+        # returns the number of (inserted, updated, removed) rows
+        if key_col is not None and key_col != self.key_col:
+            self.set_key_column(key_col)
+        self.cancel_load()
+
+        new = {}
+        for row_list in new_rows:
+            new[self._make_key(row_list[self.key_col])] = row_list
+
+        model = self.data_model
+        if self.key_col < model.columnCount():
+            keys = map(self._make_key, model.column_values(self.key_col))
+        else:
+            keys = itertools.repeat('', model.rowCount())
+
+        removed = []
+        updated = []
+        seen = set()
+        for row, key in enumerate(keys):
+            row_list = new.get(key)
+            if row_list is None or key in seen:
+                # gone, or a repeated key
+                removed.append(row)
+                continue
+            seen.add(key)
+            old = model.row_values(row)[:len(row_list)]
+            if list(map(self._make_key, row_list)) != list(map(self._make_key, old)):
+                updated.append(key)
+        inserted = [row_list for key, row_list in new.items() if key not in seen]
+
+        self.data_table.setUpdatesEnabled(False)
+        try:
+            self._remove_rows(removed)
+            # rows moved up by the removals, the key index has their new place
+            model.set_rows([(self._key_index[key], new[key]) for key in updated])
+            model.append_rows(inserted)
+        finally:
+            self.data_table.setUpdatesEnabled(True)
+
+        return len(inserted), len(updated), len(removed)
+
+    @instrumented('removal')
+    def _remove_rows(self, rows):
+        # remove model rows in contiguous ranges; valid_mask keeps the flags of
+        # the other rows and the key index is rebuilt once
+        ranges = _row_ranges(rows)
+        if not ranges:
+            return 0
+        mask = self.valid_mask
+        kept = bytearray()
+        start = 0
+        for first, last in ranges:
+            kept += mask[start:first]
+            start = last + 1
+        kept += mask[start:]
+
+        self._removing_rows = True
+        try:
+            self.data_model.remove_rows(rows)
+        finally:
+            self._removing_rows = False
+        # a bulk removal is a layout change that leaves the mask to this method
+        self.valid_mask = kept
+        self.rebuild_key_index(ranges[0][0])
+        return sum(last - first + 1 for first, last in ranges)
+
+    @staticmethod
+    def _row_chunks(source, chunk_size):
+        # lists of rows from a DB-API cursor (fetchmany) or any iterable
+        if hasattr(source, 'fetchmany'):
+            while True:
+                chunk = source.fetchmany(chunk_size)
+                if not chunk:
+                    return
+                yield list(chunk)
+        else:
+            rows = iter(source)
+            while True:
+                chunk = list(itertools.islice(rows, chunk_size))
+                if not chunk:
+                    return
+                yield chunk
+
+    def load_table_data(self, source, header=None, mode='append', chunk_size=500, frame_ms=15):
+        # stream rows into the table without blocking the event loop
+        # rows are pulled in chunks until frame_ms is used up, then the event loop
+        # runs before the next slice; loadProgress reports the rows loaded so far
+        # and loadFinished the total. If the source raises, the load stops with
+        # loadFailed(error) instead; rows loaded so far stay in the table
+        if mode not in ('replace', 'append', 'upsert'):
+            raise ValueError('unknown mode: {}'.format(mode))
+        self.cancel_load()
+
+        if header:
+            self.set_table_headers(header)
+        if mode == 'replace':
+            self.data_model.replace_rows([])
+            mode = 'append'
+
+        self._load_chunks = self._row_chunks(source, chunk_size)
+        self._load_mode = mode
+        self._load_frame_ms = frame_ms
+        self._loaded_rows = 0
+
+        # first slice right away so the first screen shows up immediately
+        self._load_next_slice()
+        if self._load_chunks is not None:
+            self.resize_table_view()
+            self._load_timer.start()
+
+    @instrumented('population')
+    def _load_next_slice(self):
+        if self._load_chunks is None:
+            self._load_timer.stop()
+            return
+
+        start = monotonic()
+        finished = False
+        try:
+            while (monotonic() - start) * 1000 < self._load_frame_ms:
+                chunk = next(self._load_chunks, None)
+                if chunk is None:
+                    finished = True
+                    break
+                if self._load_mode == 'upsert':
+                    self.upsert_rows(chunk)
+                else:
+                    self.data_model.append_rows(chunk)
+                self._loaded_rows += len(chunk)
+        except Exception as error:
+            logger.error('%s: load failed after %s rows: %s', self.name, self._loaded_rows, error)
+            self.cancel_load()
+            self.resize_table_view()
+            self._emit('loadFailed', str(error))
+            return
+
+        self._emit('loadProgress', self._loaded_rows)
+        if finished:
+            self._load_timer.stop()
+            self._load_chunks = None
+            self.resize_table_view()
+            self._emit('loadFinished', self._loaded_rows)
+
+    def is_loading(self):
+        return self._load_chunks is not None
+
+    def cancel_load(self):
+        # stop a running load_table_data, rows loaded so far stay in the table
+        self._load_timer.stop()
+        self._load_chunks = None
+
+    @instrumented('population')
     def add_single_row(self, row_list, raw_data=None):
 
         # check if osa already in the list
-        item_exists = self.data_model.findItems(row_list[0], column=0)
-
-        result_model_row = []
-        for i in row_list:
-            item = QtGui.QStandardItem(str(i))
-            result_model_row.append(item)
+        existing_row = self.row_for_key(row_list[self.key_col])
 
-        if len(item_exists) == 0:
+        if existing_row == -1:
             # append row to the end
-            self.data_model.appendRow(result_model_row)
+            self.data_model.append_row(row_list)
 
-        elif len(item_exists) > 0:
-            # delete existing row
-            self.data_model.removeRow(item_exists[0].row())
-            # update row
-            self.data_model.appendRow(result_model_row)
-
-        self.data_model.dataChanged.emit(QtGui.QStandardItem('').index(),
-                                         QtGui.QStandardItem('').index())
+        else:
+            # update row in place
+            self.data_model.set_row(existing_row, row_list)
 
-    def resize_table_view(self):
+    @instrumented('resize')
+    def resize_table_view(self, sample_rows=200):
         # fit table to contents and stretch last column
+        # large tables are measured on the first sample_rows rows only
 
-        self.data_table.resizeColumnsToContents()
-        self.data_table.resizeRowsToContents()
+        if self.data_model.rowCount() <= sample_rows:
+            self.data_table.resizeColumnsToContents()
+            self.data_table.resizeRowsToContents()
+        else:
+            font_metrics = self.data_table.fontMetrics()
+            header = self.data_table.horizontalHeader()
+            for c in range(self.data_model.columnCount()):
+                width = max(font_metrics.width(self.data_model.cell_text(r, c)) for r in range(sample_rows))
+                self.data_table.setColumnWidth(c, max(width + 12, header.sectionSizeHint(c)))
+            self.data_table.verticalHeader().setDefaultSectionSize(font_metrics.height() + 8)
         # self.resize_widget_to_contents()
 
         self.data_table.horizontalHeader().setStretchLastSection(True)
 
     def get_selected_row_name(self, col=0):
 
-        current_index = self.data_table.selectionModel().currentIndex()
+        current_index = self.proxy_model.mapToSource(self.data_table.selectionModel().currentIndex())
 
-        return self.data_model.item(current_index.row(), col).text()
+        return self.data_model.cell_text(current_index.row(), col)
 
     def remove_row(self):
-        # remove selected row from the table
-        # QModelIndex currentIndex = ui->tableView->selectionModel()->currentIndex();
-        # model->removeRow(currentIndex.row());
-        current_index = self.data_table.selectionModel().currentIndex()
-
-        if current_index.row() in self.valid_rows:
-            self.valid_rows.remove(current_index.row())
-
-        self.data_model.removeRow(current_index.row())
+        # remove the current row from the table
+        current_index = self.proxy_model.mapToSource(self.data_table.selectionModel().currentIndex())
+        if current_index.isValid():
+            self._remove_rows([current_index.row()])
+
+    def remove_selected_rows(self):
+        # remove all selected rows; returns the number of removed rows
+        return self._remove_rows(self.selected_rows())
+
+    def remove_rows_by_keys(self, keys):
+        # remove the rows holding keys in the key column; unknown keys are skipped
+        rows = (self.row_for_key(key) for key in keys)
+        return self._remove_rows([row for row in rows if row != -1])
+
+    def remove_rows_where(self, predicate, col=None):
+        # remove rows for which predicate(row values) is true, or
+        # predicate(cell value) when col is given
+        if col is None:
+            rows = (row for row in range(self.data_model.rowCount())
+                    if predicate(self.data_model.row_values(row)))
+        else:
+            rows = (row for row, value in enumerate(self.data_model.column_values(col))
+                    if predicate(value))
+        return self._remove_rows(list(rows))
+
+    def selected_rows(self):
+        # model rows of the selection, in model order
+        selection = self.data_table.selectionModel().selectedRows()
+        return sorted({self.proxy_model.mapToSource(index).row() for index in selection})
+
+    def _export_row_list(self, rows):
+        # row numbers for 'all' (None), 'selected', 'valid' or a list of rows
+        if rows == 'all':
+            return None
+        if rows == 'selected':
+            return self.selected_rows()
+        if rows == 'valid':
+            return self.valid_rows
+        if isinstance(rows, str):
+            raise ValueError('unknown rows: {}'.format(rows))
+        return list(rows)
+
+    def _export(self, writer, path, rows):
+        headers = [self.data_model.headerData(col, QtCore.Qt.Horizontal)
+                   for col in range(self.data_model.columnCount())]
+        if self.virtual:
+            # the file may be the snapshot the table was loaded from
+            self.data_model.release_file(path)
+        columns = self.data_model.column_snapshot()
+        row_list = self._export_row_list(rows)
+
+        def write():
+            try:
+                return writer(path, headers, columns, row_list)
+            finally:
+                close_columns(columns)
+
+        query_runner().run(write, (),
+                           on_result=lambda count: self._emit('exportFinished', path, count),
+                           on_error=functools.partial(self._emit, 'exportFailed'))
+
+    @instrumented('export')
+    def export_csv(self, path, rows='all'):
+        # write rows ('all', 'selected', 'valid' or a list of rows) to a csv file
+        # in a worker thread; exportFinished(path, row count) or exportFailed(error)
+        # follows. Without virtual the cells are first copied on the GUI thread.
+        self._export(write_csv, path, rows)
+
+    @instrumented('export')
+    def export_snapshot(self, path, rows='all'):
+        # same as export_csv, to a binary snapshot that load_snapshot reads back
+        self._export(write_snapshot, path, rows)
+
+    @instrumented('population')
+    def load_snapshot(self, path):
+        # replace the rows with a snapshot file; the virtual model reads the
+        # cells from the mapped file and copies only columns that are changed
+        self.cancel_load()
+        headers, columns = read_snapshot(path)
+        self.set_table_headers(headers)
+        if self.virtual:
+            self.data_model.set_columns(headers, columns)
+        else:
+            self.data_model.replace_rows([list(row_list) for row_list in zip(*columns)])
+            close_columns(columns)
+        self.resize_table_view()
+        return self.data_model.rowCount()
 
+    def set_sorting_enabled(self, state=True):
+        # sort by clicking the column headers; starts unsorted
+        if state:
+            self.data_table.horizontalHeader().setSortIndicator(-1, QtCore.Qt.AscendingOrder)
+        self.data_table.setSortingEnabled(state)
+
+    def sort_by_column(self, col, order=QtCore.Qt.AscendingOrder):
+        # col < 0 goes back to the order the rows were added in
+        self.proxy_model.sort(col, order)
+        self.data_table.horizontalHeader().setSortIndicator(col, order)
+
+    def set_filter(self, col, value):
+        # show only rows whose column col contains value (ignoring case) or for
+        # which value(cell) is true; filters of several columns must all match
+        self.proxy_model.set_filter(col, value)
+
+    def clear_filters(self):
+        self.proxy_model.clear_filters()
+
+    def view_row(self, row):
+        # row of the view showing model row, -1 if filtered out
+        return self.proxy_model.view_row(row)
+
+    def model_row(self, view_row):
+        # model row shown in a row of the view
+        return self.proxy_model.source_row(view_row)
+
+    @staticmethod
+    def _make_key(value):
+        # keys compare as the shown text, None is an empty cell
+        if value is None:
+            return ''
+        return str(value)
+
+    def row_for_key(self, key):
+        # row holding key in the key column, -1 if not in the table
+        return self._key_index.get(self._make_key(key), -1)
+
+    def set_key_column(self, col):
+        self.key_col = col
+        self.rebuild_key_index()
+
+    def rebuild_key_index(self, start=0):
+        # (re)index rows from start onwards; first row wins on duplicate keys
+        if start == 0:
+            self._key_index = {}
+        else:
+            self._key_index = {k: r for k, r in self._key_index.items() if r < start}
+
+        if self.key_col >= self.data_model.columnCount():
+            return
+        for row in range(start, self.data_model.rowCount()):
+            self._key_index.setdefault(self._make_key(self.data_model.cell_value(row, self.key_col)), row)
+
+    def _rows_inserted(self, parent, first, last):
+        self.valid_mask[first:first] = bytearray(last - first + 1)
+
+        if last + 1 < self.data_model.rowCount():
+            # inserted in the middle, following rows moved down
+            self._typed_columns = {}
+            self.rebuild_key_index(first)
+            return
+
+        self._update_typed_columns(first, last, append=True)
+        if self.key_col >= self.data_model.columnCount():
+            return
+        for row in range(first, last + 1):
+            self._key_index.setdefault(self._make_key(self.data_model.cell_value(row, self.key_col)), row)
+
+    def _rows_removed(self, parent, first, last):
+        del self.valid_mask[first:last + 1]
+        for typed in self._typed_columns.values():
+            del typed[first:last + 1]
+        if not self._removing_rows:
+            # _remove_rows rebuilds once after all ranges
+            self.rebuild_key_index(first)
+
+    def _data_changed(self, top_left, bottom_right):
+        if self._updating_states:
+            return
+        if not top_left.isValid() or not bottom_right.isValid():
+            self._typed_columns = {}
+            return
+        self._update_typed_columns(top_left.row(), bottom_right.row(),
+                                   cols=range(top_left.column(), bottom_right.column() + 1))
+
+    def _model_reset(self):
+        self.valid_mask = bytearray(self.data_model.rowCount())
+        self._typed_columns = {}
+        self.rebuild_key_index()
+
+    def _layout_about_to_change(self):
+        # rows may be reordered; remember the valid rows as persistent indexes
+        if self._removing_rows:
+            # _remove_rows keeps the mask itself
+            return
+        self._valid_persistent = [QtCore.QPersistentModelIndex(self.data_model.index(row, 0))
+                                  for row in self.valid_rows]
+
+    def _layout_changed(self):
+        # valid_mask follows the rows to their new places
+        self._typed_columns = {}
+        if self._removing_rows:
+            return
+        mask = bytearray(self.data_model.rowCount())
+        for index in self._valid_persistent:
+            if index.isValid():
+                mask[index.row()] = 1
+        self._valid_persistent = []
+        self.valid_mask = mask
+        self.rebuild_key_index()
+
+    def _parse_int_column(self, col, first=0, last=None):
+        return array('q', map(int, self.data_model.column_values(col, first, last)))
+
+    def _update_typed_columns(self, first, last, cols=None, append=False):
+        # re-parse rows first..last of the cached columns; a column that no
+        # longer parses is dropped and raises again on the next typed_column
+        for col in list(self._typed_columns):
+            if cols is not None and col not in cols:
+                continue
+            try:
+                values = self._parse_int_column(col, first, last)
+            except (TypeError, ValueError):
+                del self._typed_columns[col]
+                continue
+            if append:
+                self._typed_columns[col].extend(values)
+            else:
+                self._typed_columns[col][first:last + 1] = values
+
+    def typed_column(self, col):
+        # column col parsed as int, one value per row; parsed once and then
+        # updated with the model, so repeated validation skips the text parsing
+        if col not in self._typed_columns:
+            self._typed_columns[col] = self._parse_int_column(col)
+        return self._typed_columns[col]
+
+    @property
+    def valid_rows(self):
+        # rows that passed the last check_valid_data
+        return list(itertools.compress(range(len(self.valid_mask)), self.valid_mask))
+
+    @valid_rows.setter
+    def valid_rows(self, rows):
+        self.valid_mask = bytearray(self.data_model.rowCount())
+        for row in rows:
+            self.valid_mask[row] = 1
+
+    @instrumented('validation')
     def check_valid_data(self, col=None, valid_value=[]):
         # check all data whether it is valid or not.
-        self.data_validity = True
-        for r in range(self.data_model.rowCount()):
-            row_validity = self.check_valid_data_row(r, col, valid_value=valid_value)
+        # validity values are in the hidden column col, checked in one pass over
+        # its parsed values against a set of the valid values
+        valid_value = frozenset(valid_value)
+        self.valid_mask = bytearray(map(valid_value.__contains__, self.typed_column(col)))
+        self.data_validity = 0 not in self.valid_mask
 
-            if row_validity:
-                # valid rows are added to a list for reference
-                self.valid_rows.append(r)
-                self.valid_rows = list(set(self.valid_rows))
-            else:
-                # invalid rows set widget validity flag to false and the respective row colour becomes red
-                self.data_validity = False
-                self.update_row_color(r, 'red')
+        # invalid rows set widget validity flag to false and the respective row colour becomes red
+        rows = range(len(self.valid_mask))
+        self.set_row_states(itertools.compress(rows, self.valid_mask), 'valid')
+        self.set_row_states(itertools.compress(rows, (not v for v in self.valid_mask)), 'invalid')
 
         return self.data_validity
 
@@ -588,26 +3707,32 @@ class DBTable(DBWidget):
         # validity values are in the hidden column
         # valid values are passed from the worker
 
-        if int(self.data_model.item(row, col).text()) in valid_value:
-            is_valid = True
-        else:
-            is_valid = False
-
-        return is_valid
+        return self.typed_column(col)[row] in valid_value
 
     def update_row_color(self, row, clr_txt):
         # change colour of all items in the row
+        # the colour is used as a row state, see ROW_STATES
+
+        self.set_row_states([row], clr_txt)
 
-        for c in range(self.data_model.columnCount()):
-            self.data_model.item(row, c).setBackground(QtGui.QBrush(QtGui.QColor(clr_txt)))
+    @instrumented('highlight')
+    def set_row_states(self, rows, state):
+        # put rows in a state of ROW_STATES; one model update for all rows
+        # values do not change, so the typed columns are left alone
+        self._updating_states = True
+        try:
+            self.data_model.set_row_states(rows, state)
+        finally:
+            self._updating_states = False
+
+    def row_state(self, row):
+        return self.data_model.row_state(row)
 
     def get_valid_row_column_data(self, col):
         # for valid rows, get the value of the hidden column
         valid_column_data = []
-        if self.data_validity:
-            for row in self.valid_rows:
-                if self.data_model.item(row, col):
-                    valid_column_data.append(int(self.data_model.item(row, col).text()))
+        if self.data_validity and col < self.data_model.columnCount():
+            valid_column_data = list(itertools.compress(self.typed_column(col), self.valid_mask))
 
         return valid_column_data
 
@@ -615,11 +3740,648 @@ class DBTable(DBWidget):
         # table data row count
         return self.data_model.rowCount()
 
+    def connect_input_signals(self):
+        self.data_table.customContextMenuRequested.connect(self.right_click_menu)
+
     def right_click_menu(self, point):
-        # right click menu to allow deletion of rows
-        remove_action = QtGui.QAction('Remove selected row', self)
-        remove_action.triggered.connect(self.remove_row)
+        # right click menu to allow deletion of rows; the menu is reused
+        self.remove_action.setEnabled(self.data_table.selectionModel().hasSelection())
+        self.context_menu().popup(self.data_table.viewport().mapToGlobal(point))
+
+    def get_state(self):
+        # rows as columns, validity, row states and the selection
+        model = self.data_model
+        snapshot = model.column_snapshot()
+        columns = [list(column) for column in snapshot]
+        close_columns(snapshot)
+        return {'headers': [str(model.headerData(col, QtCore.Qt.Horizontal))
+                            for col in range(model.columnCount())],
+                'columns': columns,
+                'key_col': self.key_col,
+                'valid_mask': list(self.valid_mask),
+                'data_validity': self.data_validity,
+                'row_states': [model.row_state(row) for row in range(model.rowCount())],
+                'selection': self.selected_rows(),
+                'raw_data': self.raw_data}
+
+    def restore_state(self, state):
+        self.cancel_load()
+        self.key_col = state['key_col']
+        self.set_table_headers(state['headers'])
+        columns = state['columns']
+        if self.virtual:
+            self.data_model.set_columns(state['headers'], columns)
+        else:
+            self.data_model.replace_rows([list(row_list) for row_list in zip(*columns)])
+        # the model reset cleared the validity
+        self.valid_mask = bytearray(state['valid_mask'])
+        self.data_validity = state['data_validity']
+        self.raw_data = state['raw_data'] or {}
+
+        rows_of = {}
+        for row, row_state in enumerate(state['row_states']):
+            if row_state is not None:
+                rows_of.setdefault(row_state, []).append(row)
+        for row_state, rows in rows_of.items():
+            self.set_row_states(rows, row_state)
+
+        self.select_rows(state['selection'])
+        self.resize_table_view()
+
+    def select_rows(self, rows):
+        # select model rows, replacing the selection
+        selection = QtGui.QItemSelection()
+        last_col = self.proxy_model.columnCount() - 1
+        view_rows = (self.view_row(row) for row in rows)
+        for first, last in _row_ranges(row for row in view_rows if row != -1):
+            selection.select(self.proxy_model.index(first, 0), self.proxy_model.index(last, last_col))
+        self.data_table.selectionModel().select(
+            selection, QtGui.QItemSelectionModel.ClearAndSelect | QtGui.QItemSelectionModel.Rows)
+
+    def memory_usage(self):
+        usage = super().memory_usage()
+        usage['cells'] = usage['rows'] * self.data_model.columnCount()
+        # python side row bookkeeping: key index, validity, typed columns and
+        # the sort order of the view
+        index_bytes = (sys.getsizeof(self._key_index) + len(self.valid_mask)
+                       + sum(typed.itemsize * len(typed) for typed in self._typed_columns.values()))
+        usage['index_kb'] = (index_bytes + self.proxy_model.order_bytes()) // 1024
+        if self.virtual:
+            usage.update(self.data_model.storage_usage())
+        return usage
+
+
+# widget pool #################################################################
+class DBWidgetPool(object):
+    """Reusable DB widgets for the next session
+
+    - release() resets a widget, drops its signal connections (also those to
+    its input widget), puts back the read-only state, focus policy and font
+    it was made with and keeps it hidden without a parent; acquire() hands out
+    a kept widget of the same type and constructor options, or makes a new one
+    - at most max_per_type widgets are kept per type, others are deleted
+    - releasing a widget that is already in the pool does nothing
+    """
+
+    def __init__(self, max_per_type=50):
+        self.max_per_type = max_per_type
+        self._free = {}
+        # ids of the widgets in _free
+        self._pooled = set()
+        # key -> input settings of a new widget
+        self._defaults = {}
+        self.created = 0
+        self.reused = 0
+
+    @staticmethod
+    def _key(cls, kwargs):
+        return (cls, tuple(sorted(kwargs.items())))
+
+    def acquire(self, cls, parent=None, name=None, **kwargs):
+        # kwargs are constructor options, e.g. virtual=True of DBTable
+        key = self._key(cls, kwargs)
+        free = self._free.get(key)
+        if free:
+            self.reused += 1
+            widget = free.pop()
+            self._pooled.discard(id(widget))
+            widget.setParent(parent)
+            if name is not None:
+                widget.name = name
+                widget.setObjectName(name)
+            if parent is not None:
+                widget.show()
+            return widget
+
+        self.created += 1
+        if name is not None:
+            kwargs['name'] = name
+        widget = cls(parent, **kwargs)
+        widget._pool_key = key
+        if hasattr(widget, 'input_settings'):
+            self._defaults.setdefault(key, widget.input_settings())
+        return widget
+
+    def _default_settings(self, key):
+        # input settings of a new widget of key; made from a spare widget for
+        # widgets that were not made by acquire
+        if key not in self._defaults:
+            cls, options = key
+            spare = cls(None, **dict(options))
+            self._defaults[key] = spare.input_settings()
+            spare.deleteLater()
+        return self._defaults[key]
+
+    def release(self, widget):
+        # widgets not made by acquire are pooled as made without options
+        if id(widget) in self._pooled:
+            return
+        key = getattr(widget, '_pool_key', self._key(type(widget), {}))
+        free = self._free.setdefault(key, [])
+        if len(free) >= self.max_per_type:
+            widget.deleteLater()
+            return
+
+        widget.reset()
+        if hasattr(widget, 'disconnect_signals'):
+            widget.disconnect_signals()
+        if hasattr(widget, 'restore_input_settings'):
+            widget.restore_input_settings(self._default_settings(key))
+        if hasattr(widget, 'input_box'):
+            widget.input_box.setTitle('')
+        widget.hide()
+        widget.setParent(None)
+        free.append(widget)
+        self._pooled.add(id(widget))
+
+    def release_children(self, root):
+        # release every DB widget inside root, e.g. a form at the end of a session
+        for widget in root.findChildren(DBWidget) + root.findChildren(DBIcon):
+            self.release(widget)
+
+    def size(self):
+        return sum(len(free) for free in self._free.values())
+
+    def clear(self):
+        for free in self._free.values():
+            for widget in free:
+                widget.deleteLater()
+        self._free = {}
+        self._pooled = set()
+
+
+widget_pool = DBWidgetPool()
+
+
+# memory accounting ###########################################################
+def _accounted_widgets(root=None):
+    # DB widgets and icons under root, or in all top level widgets
+    roots = [root] if root is not None else QtGui.QApplication.topLevelWidgets()
+    widgets = []
+    for top in roots:
+        if isinstance(top, (DBWidget, DBIcon)):
+            widgets.append(top)
+        widgets.extend(top.findChildren(DBWidget))
+        widgets.extend(top.findChildren(DBIcon))
+    return widgets
+
+
+def memory_report(root=None):
+    # memory_usage of every DB widget under root (default: the whole
+    # application), the largest first, with the shared caches and totals
+    widgets = sorted((widget.memory_usage() for widget in _accounted_widgets(root)),
+                     key=lambda usage: usage['cells'], reverse=True)
+    return {
+        'widgets': widgets,
+        'rows': sum(usage['rows'] for usage in widgets),
+        'cells': sum(usage['cells'] for usage in widgets),
+        'children': sum(usage['children'] for usage in widgets),
+        'pixmap_cache': pixmap_cache.stats(),
+        'reference_cache': reference_cache.stats(),
+    }
+
+
+class DBLeakMonitor(QtCore.QObject):
+    """Flags widgets whose number of child objects keeps growing
+
+    - watched widgets are sampled every interval_ms (or on check())
+    - a widget whose child count grew on the last checks, samples in a row, is
+    reported once with leakSuspected(name, count) and a log warning; it is
+    reported again after its count stopped growing and grows again
+    """
+
+    leakSuspected = QtCore.pyqtSignal(str, int)
+
+    def __init__(self, interval_ms=60000, samples=5, parent=None):
+        super().__init__(parent)
+        self.samples = samples
+        # id -> widget / recent child counts
+        self._widgets = {}
+        self._counts = {}
+        self._suspects = set()
+        self._timer = QtCore.QTimer(self)
+        self._timer.setInterval(interval_ms)
+        self._timer.timeout.connect(self.check)
+
+    def watch(self, widget):
+        key = id(widget)
+        if key in self._widgets:
+            return
+        self._widgets[key] = widget
+        self._counts[key] = deque(maxlen=self.samples + 1)
+        widget.destroyed.connect(lambda *_, key=key: self._forget(key))
+
+    def watch_all(self, root=None):
+        # watch the DB widgets under root, default the whole application
+        for widget in _accounted_widgets(root):
+            self.watch(widget)
+
+    def unwatch(self, widget):
+        self._forget(id(widget))
+
+    def start(self, interval_ms=None):
+        if interval_ms is not None:
+            self._timer.setInterval(interval_ms)
+        self._timer.start()
+
+    def stop(self):
+        self._timer.stop()
+
+    def check(self):
+        # sample all watched widgets; returns the names of the suspected ones
+        for key, widget in list(self._widgets.items()):
+            counts = self._counts[key]
+            counts.append(len(widget.findChildren(QtCore.QObject)))
+            growing = (len(counts) == counts.maxlen
+                       and all(a < b for a, b in zip(counts, itertools.islice(counts, 1, None))))
+            if growing and key not in self._suspects:
+                self._suspects.add(key)
+                logger.warning('%s: child objects keep growing (%s)', widget.name, counts[-1])
+                self.leakSuspected.emit(widget.name, counts[-1])
+            elif not growing and len(counts) > 1 and counts[-1] <= counts[-2]:
+                self._suspects.discard(key)
+        return self.suspects()
+
+    def suspects(self):
+        return [self._widgets[key].name for key in self._suspects]
+
+    def _forget(self, key):
+        self._widgets.pop(key, None)
+        self._counts.pop(key, None)
+        self._suspects.discard(key)
+
+
+# session snapshots ###########################################################
+# session file: magic | json widget states | json index | index position
+# (uint64) | magic
+# plain json, so a changed session file cannot run code when it is loaded
+SESSION_MAGIC = b'DBSESS01'
+SESSION_FORMAT = 1
+# state entries dropped when json cannot hold them (e.g. ORM records)
+OPTIONAL_STATE = ('records', 'raw_data')
+
+
+def _is_json(value):
+    # True if value is kept by json (tuples come back as lists)
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return True
+    if isinstance(value, (list, tuple)):
+        return all(map(_is_json, value))
+    if isinstance(value, dict):
+        return all(isinstance(key, str) and _is_json(item) for key, item in value.items())
+    return False
+
+
+def _encode_state(name, state):
+    # other values json cannot hold (dates, decimals, ...) are saved as their text
+    dropped = [key for key in OPTIONAL_STATE if key in state and not _is_json(state[key])]
+    if dropped:
+        logger.info('%s: state saved without %s', name, ', '.join(dropped))
+        state = dict(state, **{key: None for key in dropped})
+    return json.dumps(state, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+
+
+def _decode_state(data):
+    return json.loads(data.decode('utf-8'))
+
+
+class DBSession(QtCore.QObject):
+    """Warm start snapshot of the DB widgets of an application
+
+    - save() writes get_state() of every DB widget, by name, to one file; the
+    states are written as json one after the other with an index at the end,
+    so a state is only read when its widget is restored
+    - load() accepts only a file of this format, written by the same
+    app_version and not older than max_age_s; otherwise the start is cold
+    - restore() applies one state per event loop turn, so the window is usable
+    right away; restore_form() restores fields of a DBFormBuilder when they
+    are created
+    - with resync, each restored widget then refreshes its bound query or
+    reference list in the background
+    """
 
-        menu = QtGui.QMenu(self)
-        menu.addAction(remove_action)
-        menu.popup(self.data_table.viewport().mapToGlobal(point))
+    widgetRestored = QtCore.pyqtSignal(str)
+    restoreFinished = QtCore.pyqtSignal()
+
+    def __init__(self, path, app_version=None, max_age_s=12 * 3600, parent=None):
+        super().__init__(parent)
+        self.path = path
+        self.app_version = app_version
+        self.max_age_s = max_age_s
+        self.resync = True
+        self._header = None
+        self._queue = deque()
+        self._restored = set()
+        self._timer = QtCore.QTimer(self)
+        self._timer.setInterval(0)
+        self._timer.timeout.connect(self._restore_next)
+
+    def save(self, root=None):
+        # snapshot of the DB widgets under root (default the whole application);
+        # returns the number of saved widgets
+        index = {}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(SESSION_MAGIC)
+            for widget in _accounted_widgets(root):
+                if widget.name in index:
+                    logger.warning('%s: more than one widget of this name, saved the first', widget.name)
+                    continue
+                data = _encode_state(widget.name, widget.get_state())
+                index[widget.name] = (type(widget).__name__, f.tell(), len(data))
+                f.write(data)
+            header_pos = f.tell()
+            f.write(_encode_state('session', {'format': SESSION_FORMAT,
+                                              'app_version': self.app_version,
+                                              'saved_at': time(), 'widgets': index}))
+            f.write(struct.pack('<Q', header_pos))
+            f.write(SESSION_MAGIC)
+        os.replace(tmp_path, self.path)
+        return len(index)
+
+    def load(self):
+        # read the index of the session file; False if there is no usable one
+        self._header = None
+        tail = len(SESSION_MAGIC) + 8
+        try:
+            with open(self.path, 'rb') as f:
+                if f.read(len(SESSION_MAGIC)) != SESSION_MAGIC:
+                    raise ValueError('not a session file')
+                f.seek(-tail, os.SEEK_END)
+                header_pos = struct.unpack('<Q', f.read(8))[0]
+                if f.read(len(SESSION_MAGIC)) != SESSION_MAGIC:
+                    raise ValueError('incomplete session file')
+                end = f.tell() - tail
+                f.seek(header_pos)
+                header = _decode_state(f.read(end - header_pos))
+                if not isinstance(header, dict):
+                    raise ValueError('no session index')
+        except (OSError, ValueError, struct.error) as error:
+            logger.info('session %s not used: %s', self.path, error)
+            return False
+
+        # app_version as it reads back from json, e.g. a tuple as a list
+        app_version = _decode_state(_encode_state('session', self.app_version))
+        if header.get('format') != SESSION_FORMAT or header.get('app_version') != app_version:
+            logger.info('session %s not used: written by format %s, version %s', self.path,
+                        header.get('format'), header.get('app_version'))
+            return False
+        if time() - header['saved_at'] > self.max_age_s:
+            logger.info('session %s not used: older than %s s', self.path, self.max_age_s)
+            return False
+        self._header = header
+        return True
+
+    def age_s(self):
+        # age of the loaded session, None if none is loaded
+        if self._header is None:
+            return None
+        return time() - self._header['saved_at']
+
+    def names(self):
+        return list(self._header['widgets']) if self._header is not None else []
+
+    def state(self, name):
+        # state saved for widget name, read from the file
+        _, pos, size = self._header['widgets'][name]
+        with open(self.path, 'rb') as f:
+            f.seek(pos)
+            return _decode_state(f.read(size))
+
+    def restore(self, root=None, resync=True):
+        # queue the widgets under root that have a saved state; False for a
+        # cold start
+        if self._header is None and not self.load():
+            return False
+        self.resync = resync
+        self._queue.extend(widget for widget in _accounted_widgets(root)
+                           if widget.name in self._header['widgets'])
+        self._timer.start()
+        return True
+
+    def restore_form(self, builder, resync=True):
+        # restore the fields of a form, including the ones created later
+        if self._header is None and not self.load():
+            return False
+        self.resync = resync
+        builder.fieldCreated.connect(lambda name, widget: self.restore_widget(widget))
+        self._queue.extend(builder.created_fields().values())
+        self._timer.start()
+        return True
+
+    def restore_widget(self, widget):
+        # apply the saved state of widget now; each widget is restored once
+        if self._header is None or id(widget) in self._restored:
+            return False
+        entry = self._header['widgets'].get(widget.name)
+        if entry is None or entry[0] != type(widget).__name__:
+            return False
+        self._restored.add(id(widget))
+        try:
+            widget.restore_state(self.state(widget.name))
+        except Exception as error:
+            logger.error('%s: state not restored: %s', widget.name, error)
+            return False
+        if self.resync:
+            try:
+                widget.resync()
+            except Exception as error:
+                # the restored data stays shown
+                logger.error('%s: not resynced: %s', widget.name, error)
+        self.widgetRestored.emit(widget.name)
+        return True
+
+    def _restore_next(self):
+        if self._queue:
+            self.restore_widget(self._queue.popleft())
+        if not self._queue:
+            self._timer.stop()
+            self.restoreFinished.emit()
+
+
+# form builder ################################################################
+# field types of the json form definitions
+FIELD_TYPES = {
+    'combobox': DBComboBox,
+    'lineedit': DBLineEdit,
+    'textedit': DBTextEdit,
+    'label': DBLabel,
+    'table': DBTable,
+    'icon': DBIcon,
+}
+
+
+class DBLazyPage(QtGui.QWidget):
+    """Page of a built form; its fields are created when it is first shown
+
+    - until then the page is an empty placeholder holding the field definitions
+    - build() creates the fields right away, e.g. when a field is needed early
+    """
+
+    def __init__(self, builder, fields, parent=None):
+        super().__init__(parent)
+        self.builder = builder
+        self.field_specs = fields
+        self.fields = OrderedDict()
+        self.built = False
+        self.vbox = QtGui.QVBoxLayout(self)
+        # fields go above the stretch; added once, pages are rebuilt after
+        # DBFormBuilder.release
+        self.vbox.addStretch(1)
+
+    def showEvent(self, event):
+        self.build()
+        super().showEvent(event)
+
+    def build(self):
+        if self.built:
+            return
+        self.built = True
+        for spec in self.field_specs:
+            widget = self.builder.create_field(spec, self)
+            self.vbox.insertWidget(self.vbox.count() - 1, widget)
+            self.fields[spec['name']] = widget
+
+
+class DBFormBuilder(QtCore.QObject):
+    """Builds a form from a json definition
+
+    {"tabs": [{"title": "Scan", "fields": [
+        {"type": "combobox", "name": "location", "title": "Location *",
+         "focus": "strong", "font_size": 12, "items": ["", "A1", "A2"]},
+        {"type": "table", "name": "parts", "title": "Parts", "virtual": true,
+         "headers": ["OSA", "Part", "Id"], "hidden_columns": "2"}]}]}
+
+    - types are the keys of FIELD_TYPES; a definition with "fields" instead of
+    "tabs" builds a single page
+    - a combobox with "reference": key shows the list registered under key in
+    reference_cache instead of "items"
+    - every tab is a DBLazyPage, so only the shown tab creates its widgets;
+    fieldCreated(name, widget) is emitted for each widget when it is created
+    - with a DBWidgetPool the widgets come from the pool, and release() gives
+    them back at the end of the session
+    - batch_update() fills a record into many fields with one repaint and one
+    fieldsChanged at the end
+    """
+
+    fieldCreated = QtCore.pyqtSignal(str, object)
+    fieldsChanged = QtCore.pyqtSignal(object)
+
+    def __init__(self, definition, parent=None, pool=None):
+        super().__init__(parent)
+        self.pool = pool
+        # widget returned by build()
+        self.widget = None
+        if 'tabs' in definition:
+            self.tabs = definition['tabs']
+        else:
+            self.tabs = [{'title': definition.get('title', ''), 'fields': definition.get('fields', [])}]
+        self.pages = []
+        # field name -> tab number
+        self._page_of = {}
+
+        for tab_number, tab in enumerate(self.tabs):
+            for spec in tab['fields']:
+                if spec.get('type') not in FIELD_TYPES:
+                    raise ValueError('unknown field type {!r} of field {!r}'.format(
+                        spec.get('type'), spec.get('name')))
+                if spec['name'] in self._page_of:
+                    raise ValueError('duplicate field name {!r}'.format(spec['name']))
+                self._page_of[spec['name']] = tab_number
+
+    @classmethod
+    def from_json(cls, path, parent=None, pool=None):
+        with open(path) as f:
+            return cls(json.load(f), parent, pool)
+
+    def build(self, parent=None):
+        # widget holding the form: a tab widget, or the page itself for one tab
+        self.pages = [DBLazyPage(self, tab['fields']) for tab in self.tabs]
+        if len(self.pages) == 1:
+            self.pages[0].setParent(parent)
+            self.widget = self.pages[0]
+            return self.widget
+
+        tab_widget = QtGui.QTabWidget(parent)
+        for page, tab in zip(self.pages, self.tabs):
+            tab_widget.addTab(page, tab.get('title', ''))
+        self.widget = tab_widget
+        return tab_widget
+
+    @contextmanager
+    def batch_update(self):
+        # batch_update over the whole form; fieldsChanged({name: value}) is
+        # emitted once at the end for the fields that changed
+        if self.widget is None:
+            raise RuntimeError('form is not built yet')
+        with batch_update(self.widget) as changed:
+            yield changed
+        if changed:
+            self.fieldsChanged.emit(dict(changed))
+
+    def field(self, name):
+        # widget of a field, created now if its page has not been shown yet
+        if not self.pages:
+            raise RuntimeError('form is not built yet')
+        page = self.pages[self._page_of[name]]
+        page.build()
+        return page.fields[name]
+
+    def field_names(self):
+        return list(self._page_of)
+
+    def created_fields(self):
+        # widgets created so far, by name
+        fields = OrderedDict()
+        for page in self.pages:
+            fields.update(page.fields)
+        return fields
+
+    def create_field(self, spec, parent):
+        field_type = spec['type']
+        kwargs = {'name': spec['name']}
+        if field_type == 'table':
+            kwargs['virtual'] = spec.get('virtual', False)
+            kwargs['key_col'] = spec.get('key_col', 0)
+        elif field_type == 'icon':
+            kwargs['set_icon'] = spec.get('icon', 'ok')
+            if 'state' in spec:
+                kwargs['set_state'] = spec['state']
+            if 'icon_size' in spec:
+                kwargs['icon_size'] = tuple(spec['icon_size'])
+        if self.pool is not None:
+            widget = self.pool.acquire(FIELD_TYPES[field_type], parent, **kwargs)
+        else:
+            widget = FIELD_TYPES[field_type](parent, **kwargs)
+
+        # icons have no groupbox, labels cannot be edited
+        if 'title' in spec and hasattr(widget, 'update_title'):
+            widget.update_title(spec['title'], font_size=spec.get('title_font_size', 14))
+        if 'focus' in spec and hasattr(widget, 'set_focus_policy'):
+            widget.set_focus_policy(spec['focus'])
+        if 'read_only' in spec and hasattr(widget, 'setReadOnly'):
+            widget.setReadOnly(spec['read_only'])
+        if 'font_size' in spec and hasattr(widget, 'input_values'):
+            widget.increase_font(widget.input_values, spec['font_size'])
+        if field_type == 'table' and 'headers' in spec:
+            hidden = spec.get('hidden_columns')
+            if isinstance(hidden, list):
+                hidden = ','.join(str(col) for col in hidden)
+            widget.set_table_headers(spec['headers'], hide=hidden)
+        if field_type == 'combobox' and 'items' in spec:
+            widget.add_items(spec['items'], [], font_size=spec.get('font_size', 12))
+        elif field_type == 'combobox' and 'reference' in spec:
+            widget.bind_reference(spec['reference'], font_size=spec.get('font_size', 12))
+
+        self.fieldCreated.emit(spec['name'], widget)
+        return widget
+
+    def release(self):
+        # give the created widgets back to the pool
+        if self.pool is None:
+            return
+        for widget in self.created_fields().values():
+            self.pool.release(widget)
+        for page in self.pages:
+            page.fields = OrderedDict()
+            page.built = False
@@ -0,0 +1,203 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+test_snapshots
+
+round trips of the table snapshot files (write_snapshot, read_snapshot,
+DBMappedColumn) and of the DBSession file layout.
+
+usage:
+    python -m pytest tests
+    python -m unittest discover tests
+
+"""
+
+import os
+import sys
+import json
+import struct
+import shutil
+import tempfile
+import unittest
+from decimal import Decimal
+from datetime import date
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+try:
+    from PyQt4 import QtGui
+except ImportError:
+    QtGui = None
+try:
+    import custom_qt_widgets as cqw
+except ImportError:
+    # PyQt4 is not installed
+    cqw = None
+
+
+@unittest.skipIf(cqw is None, 'custom_qt_widgets needs PyQt4')
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'table.snap')
+        self.opened = []
+
+    def tearDown(self):
+        for columns in self.opened:
+            cqw.close_columns(columns)
+        shutil.rmtree(self.dir)
+
+    def read(self, path=None):
+        headers, columns = cqw.read_snapshot(path or self.path)
+        self.opened.append(columns)
+        return headers, columns
+
+    def test_round_trip(self):
+        columns = [[1, 2, 3], ['a', 'b\nc', ''], [None, 1.5, [1, 'x']]]
+        self.assertEqual(cqw.write_snapshot(self.path, ['n', 't', 'v'], columns), 3)
+        headers, mapped = self.read()
+        self.assertEqual(headers, ['n', 't', 'v'])
+        self.assertEqual([list(column) for column in mapped], columns)
+        self.assertEqual(mapped[1][1], 'b\nc')
+        self.assertEqual(mapped[2][-1], [1, 'x'])
+        self.assertEqual(mapped[0][1:], [2, 3])
+
+    def test_rows_subset(self):
+        columns = [[10, 11, 12, 13], ['a', 'b', 'c', 'd']]
+        self.assertEqual(cqw.write_snapshot(self.path, ['n', 't'], columns, rows=[3, 1]), 2)
+        _, mapped = self.read()
+        self.assertEqual([list(column) for column in mapped], [[13, 11], ['d', 'b']])
+
+    def test_empty_table(self):
+        self.assertEqual(cqw.write_snapshot(self.path, ['a', 'b'], [[], []]), 0)
+        headers, mapped = self.read()
+        self.assertEqual(headers, ['a', 'b'])
+        self.assertEqual([list(column) for column in mapped], [[], []])
+
+        self.assertEqual(cqw.write_snapshot(self.path, [], []), 0)
+        self.assertEqual(self.read(), ([], []))
+
+    def test_non_json_cells(self):
+        # saved as their text
+        cqw.write_snapshot(self.path, ['d'], [[date(2020, 1, 2), Decimal('1.50')]])
+        _, mapped = self.read()
+        self.assertEqual(list(mapped[0]), ['2020-01-02', '1.50'])
+
+    def test_not_a_snapshot(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'not a snapshot file at all')
+        with self.assertRaises(ValueError):
+            cqw.read_snapshot(self.path)
+
+    def test_detached_copy_keeps_the_file_values(self):
+        cqw.write_snapshot(self.path, ['n'], [[1, 2, 3]])
+        _, mapped = self.read()
+        column = mapped[0]
+        copy = column.detached()
+        column[0] = 99
+        column.append(4)
+        del column[1]
+        self.assertEqual(list(column), [99, 3, 4])
+        self.assertFalse(column.is_mapped())
+        self.assertEqual(list(copy), [1, 2, 3])
+        self.assertEqual(len(copy), 3)
+        copy.close()
+
+    def test_close(self):
+        cqw.write_snapshot(self.path, ['a', 'b'], [[1, 2], [3, 4]])
+        _, mapped = self.read()
+        changed, unchanged = mapped
+        changed[0] = 5
+        cqw.close_columns(mapped)
+        # a changed column keeps its values, an unchanged one is empty
+        self.assertEqual(list(changed), [5, 2])
+        self.assertEqual(list(unchanged), [])
+        self.assertFalse(unchanged.is_mapped())
+        self.assertFalse(any(column.maps(self.path) for column in mapped))
+        # closing twice does nothing
+        cqw.close_columns(mapped)
+
+        # the file is no longer mapped and can be replaced
+        cqw.write_snapshot(self.path, ['c'], [[7]])
+        self.assertEqual([list(column) for column in self.read()[1]], [[7]])
+
+    def test_replace_own_file_while_mapped_copy_is_open(self):
+        cqw.write_snapshot(self.path, ['n'], [[1, 2]])
+        _, mapped = self.read()
+        copy = mapped[0].detached()
+        cqw.close_columns(mapped)
+        # the copy keeps the map until it is closed
+        self.assertEqual(list(copy), [1, 2])
+        self.assertTrue(copy.maps(self.path))
+        copy.close()
+        self.assertFalse(copy.maps(self.path))
+        cqw.write_snapshot(self.path, ['n'], [[3]])
+        self.assertEqual(list(self.read()[1][0]), [3])
+
+
+@unittest.skipIf(QtGui is None or cqw is None, 'DBSession needs PyQt4')
+class SessionFileTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = QtGui.QApplication.instance() or QtGui.QApplication([])
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'session.db')
+        self.root = QtGui.QWidget()
+        self.line = cqw.DBLineEdit(self.root, name='line')
+        self.combo = cqw.DBComboBox(self.root, name='combo')
+
+    def tearDown(self):
+        self.root.deleteLater()
+        shutil.rmtree(self.dir)
+
+    def test_layout(self):
+        self.line.set_text('abc')
+        self.assertEqual(cqw.DBSession(self.path, app_version='1').save(self.root), 2)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        magic = cqw.SESSION_MAGIC
+        self.assertEqual(data[:len(magic)], magic)
+        self.assertEqual(data[-len(magic):], magic)
+        header_pos = struct.unpack_from('<Q', data, len(data) - len(magic) - 8)[0]
+        header = json.loads(data[header_pos:len(data) - len(magic) - 8].decode('utf-8'))
+        self.assertEqual(header['format'], cqw.SESSION_FORMAT)
+        self.assertEqual(sorted(header['widgets']), ['combo', 'line'])
+        _, pos, size = header['widgets']['line']
+        self.assertEqual(json.loads(data[pos:pos + size].decode('utf-8')), {'text': 'abc'})
+
+    def test_round_trip(self):
+        self.line.set_text('abc')
+        self.combo.add_items(['x', 'y'], [])
+        cqw.DBSession(self.path, app_version='1').save(self.root)
+        self.line.clear_text()
+
+        session = cqw.DBSession(self.path, app_version='1')
+        self.assertTrue(session.load())
+        self.assertEqual(sorted(session.names()), ['combo', 'line'])
+        self.assertTrue(session.restore_widget(self.line))
+        self.assertEqual(self.line.current_value(), 'abc')
+        self.assertEqual(session.state('combo')['items'], ['x', 'y'])
+
+    def test_records_json_cannot_hold_are_dropped(self):
+        self.combo.add_items(['x', 'y'], [object(), object()])
+        cqw.DBSession(self.path).save(self.root)
+        session = cqw.DBSession(self.path)
+        self.assertTrue(session.load())
+        self.assertIsNone(session.state('combo')['records'])
+
+    def test_other_files_are_not_used(self):
+        cqw.DBSession(self.path, app_version='1').save(self.root)
+        self.assertFalse(cqw.DBSession(self.path, app_version='2').load())
+
+        with open(self.path, 'r+b') as f:
+            f.write(b'XXXXXXXX')
+        self.assertFalse(cqw.DBSession(self.path, app_version='1').load())
+
+
+if __name__ == '__main__':
+    unittest.main()